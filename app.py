@@ -1,14 +1,17 @@
+import time
+import uuid
+_RUN_STARTED = time.perf_counter()
+
 import streamlit as st
 import pandas as pd
-import json
 import warnings
-import os
-import re
-import numpy as np
-import base64
-import time
-from google import genai
-from google.genai import types
+from charts import render_chart, pick_chart_table
+from engine import DATA_FILE, collect_prior_results, get_history_context, make_client, run_query
+from jobs import JobManager
+import startup
+from scheduler import SCHEDULER
+from snippet_library import SnippetLibrary, is_followup
+import warm_reports
 
 # -----------------------------------------------------------------------------
 # 1. 配置 & CSS 注入 (DESIGN SYSTEM: CYBER-TECH)
@@ -23,9 +26,7 @@ st.set_page_config(
     initial_sidebar_state="expanded"
 )
 
-def inject_custom_css():
-    st.markdown("""
-        <style>
+CUSTOM_CSS = """
         /* 引入科幻/科技感字体 */
         @import url('https://fonts.googleapis.com/css2?family=Rajdhani:wght@400;600;700&family=JetBrains+Mono:wght@400;700&display=swap');
 
@@ -318,8 +319,15 @@ def inject_custom_css():
             background-color: var(--tech-cyan) !important;
         }
 
-        </style>
-    """, unsafe_allow_html=True)
+"""
+
+@st.cache_resource
+def get_static_assets():
+    # CSS 压缩与 Logo base64 只在进程内做一次
+    return startup.build_static_assets(CUSTOM_CSS, LOGO_FILE)
+
+def inject_custom_css():
+    st.markdown(get_static_assets()['style_html'], unsafe_allow_html=True)
 
 # -----------------------------------------------------------------------------
 # 2. 核心逻辑 (后端保持不变)
@@ -331,158 +339,49 @@ try:
 except:
     FIXED_API_KEY = ""
 
-FIXED_FILE_NAME = "hcmdata.xlsx" 
+FIXED_FILE_NAME = DATA_FILE
 LOGO_FILE = "logo.png"
 
 PREVIEW_ROW_LIMIT = 500
 EXPORT_ROW_LIMIT = 5000   
+JOB_POLL_INTERVAL_S = 0.5  # 后台任务进度轮询间隔 (局部 rerun)
 
 @st.cache_resource
 def get_client():
     if not FIXED_API_KEY: return None
     try:
-        return genai.Client(api_key=FIXED_API_KEY, http_options={'api_version': 'v1beta'})
+        return make_client(FIXED_API_KEY)
     except Exception as e:
         st.error(f"SDK INIT FAILED: {e}")
         return None
 
-def safe_generate_content(client, model_name, contents, config=None, retries=3):
-    base_delay = 5 
-    for i in range(retries):
-        try:
-            return client.models.generate_content(
-                model=model_name,
-                contents=contents,
-                config=config
-            )
-        except Exception as e:
-            error_str = str(e)
-            if "429" in error_str or "RESOURCE_EXHAUSTED" in error_str:
-                if i < retries - 1:
-                    time.sleep(base_delay * (2 ** i))
-                    continue
-            raise e
-
-@st.cache_data
-def load_data():
-    if not os.path.exists(FIXED_FILE_NAME):
-        # 创建一个假数据用于演示
-        data = {
-            '省份': ['江苏', '浙江', '上海', '江苏', '浙江', '上海'],
-            '产品': ['A', 'A', 'A', 'B', 'B', 'B'],
-            'Date': ['2023Q1', '2023Q1', '2023Q1', '2023Q2', '2023Q2', '2023Q2'],
-            'Sales_Value': [1000, 2000, 1500, 1100, 2100, 1600],
-            'Qty': [100, 200, 150, 110, 210, 160]
-        }
-        return pd.DataFrame(data)
-
+@st.cache_resource(show_spinner="⚙️ WARMING DATASET...")
+def load_workspace():
+    # cache_resource: 同一进程内共享，rerun 不再复制整张 df；磁盘快照由 startup.py 预热
     try:
-        if FIXED_FILE_NAME.endswith('.csv'):
-            df = pd.read_csv(FIXED_FILE_NAME)
-        else:
-            df = pd.read_excel(FIXED_FILE_NAME)
-        df.columns = df.columns.str.strip()
-        for col in df.columns:
-            if any(k in str(col) for k in ['额', '量', 'Sales', 'Qty', '金额']):
-                try:
-                    df[col] = pd.to_numeric(
-                        df[col].astype(str).str.replace(',', '', regex=False),
-                        errors='coerce'
-                    ).fillna(0)
-                except: pass
-        return df
+        return startup.warm_workspace(FIXED_FILE_NAME)
     except Exception as e:
         st.error(f"Data Load Error: {e}")
         return None
 
-def get_history_context(messages, turn_limit=3):
-    if len(messages) <= 1: return "无历史对话。"
-    recent_msgs = messages[:-1]
-    valid_msgs = [m for m in recent_msgs if m['type'] in ['text', 'report_block']]
-    slice_start = max(0, len(valid_msgs) - (turn_limit * 2))
-    target_msgs = valid_msgs[slice_start:]
-    context_list = []
-    for msg in target_msgs:
-        role = "User" if msg['role'] == 'user' else "AI"
-        content_str = ""
-        if msg['type'] == 'text':
-            content_str = msg['content']
-        elif msg['type'] == 'report_block':
-            data = msg['content']
-            mode = data.get('mode', 'analysis')
-            if mode == 'simple':
-                s = data.get('summary', {})
-                content_str = f"[History Data] Intent: {s.get('intent')}, Logic: {s.get('logic')}"
-            else:
-                intent = data.get('intent', '无意图')
-                insight = data.get('insight', '无洞察')
-                angles_summary = [f"<{a['title']}: {a['explanation']}>" for a in data.get('angles_data', [])]
-                content_str = f"[History Analysis] Intent: {intent} | Findings: {'; '.join(angles_summary)} | Insight: {insight}"
-        context_list.append(f"{role}: {content_str}")
-    return "\n".join(context_list)
-
-def analyze_time_structure(df):
-    time_col = None
-    for col in df.columns:
-        if '年季' in col or 'Quarter' in col or 'Date' in col:
-            sample = str(df[col].iloc[0])
-            if 'Q' in sample and len(sample) <= 6:
-                time_col = col; break
-    if time_col:
-        sorted_periods = sorted(df[time_col].unique().astype(str))
-        max_q = sorted_periods[-1]
-        min_q = sorted_periods[0]
-        mat_list = sorted_periods[-4:] if len(sorted_periods) >= 4 else sorted_periods
-        is_mat_complete = True
-        mat_list_prior = []
-        if len(sorted_periods) >= 8:
-            mat_list_prior = sorted_periods[-8:-4]
-        elif len(sorted_periods) >= 4:
-            mat_list_prior = sorted_periods[:-4]
-            is_mat_complete = False
-        else:
-            is_mat_complete = False
-        ytd_list, ytd_list_prior = [], []
-        import re
-        year_match = re.search(r'(\d{4})', str(max_q))
-        if year_match:
-            curr_year = year_match.group(1)
-            try:
-                prev_year = str(int(curr_year) - 1)
-                ytd_list = [p for p in sorted_periods if curr_year in str(p)]
-                expected_priors = [str(p).replace(curr_year, prev_year) for p in ytd_list]
-                ytd_list_prior = [p for p in sorted_periods if p in expected_priors]
-            except: pass
-        return {
-            "col_name": time_col, "all_periods": sorted_periods, "max_q": max_q, "min_q": min_q, 
-            "mat_list": mat_list, "mat_list_prior": mat_list_prior, "is_mat_complete": is_mat_complete,
-            "ytd_list": ytd_list, "ytd_list_prior": ytd_list_prior
-        }
-    return {"error": "No Time Column Found"}
-
-def build_metadata(df, time_context):
-    info = []
-    info.append(f"【Time Col】: {time_context.get('col_name')}")
-    info.append(f"【Current MAT】: {time_context.get('mat_list')}")
-    info.append(f"【Current YTD】: {time_context.get('ytd_list')}")
-    for col in df.columns:
-        dtype = str(df[col].dtype)
-        uniques = df[col].dropna().unique()
-        desc = f"- `{col}` ({dtype})"
-        if dtype == 'object' or len(uniques) < 2000:
-            vals = list(uniques[:5]) if len(uniques) > 100 else list(uniques)
-            desc += f" | EX: {vals}"
-        info.append(desc)
-    return "\n".join(info)
-
-def normalize_result(res):
-    if isinstance(res, pd.DataFrame): return res
-    if isinstance(res, pd.Series): return res.to_frame()
-    if isinstance(res, dict):
-        try: return pd.DataFrame(list(res.items()), columns=['指标', '数值'])
-        except: pass
-    try: return pd.DataFrame([res])
-    except: return pd.DataFrame({"Result": [str(res)]})
+@st.cache_resource
+def get_snippet_library():
+    return SnippetLibrary()
+
+@st.cache_resource
+def get_job_manager():
+    # 进程级任务表；每个会话只在 session_state 里记 job id
+    return JobManager()
+
+@st.cache_resource
+def get_warm_store():
+    return warm_reports.WarmReportStore()
+
+@st.cache_resource(ttl=warm_reports.WARM_MAX_AGE_H * 3600 or None)
+def start_warm_reports(dataset_version):
+    # 每个数据集版本 (及每个过期周期) 只起一次后台预计算；未过期的报告会被跳过
+    if warm_reports.WARM_POLICY == "off": return None
+    return get_job_manager().submit(warm_reports.precompute_reports, get_client(), load_workspace(), get_warm_store())
 
 def format_df_for_display(df_raw):
     if not isinstance(df_raw, pd.DataFrame): return df_raw
@@ -505,33 +404,12 @@ def format_df_for_display(df_raw):
                 df_fmt[col] = df_fmt[col].apply(lambda x: fmt.format(x) if pd.notnull(x) else "-")
     return df_fmt
 
-def parse_response(text):
-    reasoning = text
-    json_data = None
-    try:
-        start_idx = text.find('{')
-        end_idx = text.rfind('}')
-        if start_idx != -1 and end_idx != -1 and end_idx > start_idx:
-            potential_json = text[start_idx : end_idx + 1]
-            try:
-                json_data = json.loads(potential_json)
-                reasoning = text[:start_idx].strip()
-            except json.JSONDecodeError: pass
-    except Exception: pass
-    return reasoning, json_data
-
 # -----------------------------------------------------------------------------
 # 3. 页面渲染 (Front-End Components)
 # -----------------------------------------------------------------------------
 
 def render_header_nav():
-    logo_b64 = ""
-    # 尝试加载 Logo
-    if os.path.exists(LOGO_FILE):
-        with open(LOGO_FILE, "rb") as f:
-            logo_b64 = base64.b64encode(f.read()).decode()
-    
-    logo_html = f'<img src="data:image/png;base64,{logo_b64}" style="height:30px; margin-right:10px;">' if logo_b64 else '<span style="font-size:24px; margin-right:5px;">🧬</span>'
+    logo_html = get_static_assets()['logo_html']
 
     # Tech Header HTML
     nav_html = f"""
@@ -556,6 +434,120 @@ def render_header_nav():
     """
     st.markdown(nav_html.replace("\n", ""), unsafe_allow_html=True)
 
+def render_chart_block(data, spec, key=None):
+    # data: 单个 DataFrame 或 simple 模式的 {name: df}；key 为生成报告时预先算好的图表缓存键
+    if not spec: return
+    if isinstance(data, dict):
+        _, data = pick_chart_table(data, spec)
+    if data is None: return
+    png = render_chart(data, spec, key=key)
+    if png: st.image(png, use_container_width=True)
+
+def lineage_text(derived_from):
+    return "; ".join(f"{d['frame']} ← “{d['query']}”" for d in derived_from)
+
+def render_report_block(content, key_prefix):
+    # 历史消息与后台任务的实时进度共用同一套渲染 (实时进度时 content 是部分结果)
+    mode = content.get('mode', 'analysis') 
+    if content.get('warm_at'):
+        st.caption(f"⚡ PRECOMPUTED REPORT // {time.strftime('%Y-%m-%d %H:%M', time.localtime(content['warm_at']))}")
+    
+    if mode == 'simple':
+        if 'summary' in content:
+            s = content['summary']
+            cache_line = f'<li><span class="summary-label">CACHE</span> ♻️ SNIPPET REUSED</li>' if content.get('reused') else ''
+            if content.get('derived_from'):
+                cache_line += f'<li><span class="summary-label">SOURCE</span> ↳ {lineage_text(content["derived_from"])}</li>'
+            st.markdown(f"""
+            <div class="summary-box">
+                <div class="summary-title">⚡ EXECUTION PROTOCOL</div>
+                <ul class="summary-list">
+                    <li><span class="summary-label">INTENT</span> {s.get('intent', '-')}</li>
+                    <li><span class="summary-label">METRIC</span> {s.get('metrics', '-')}</li>
+                    <li><span class="summary-label">LOGIC</span> {s.get('logic', '-')}</li>
+                    {cache_line}
+                </ul>
+            </div>
+            """, unsafe_allow_html=True)
+        elif 'data' in content:
+            st.success("DATA EXTRACTION COMPLETE")
+        
+        if 'data' in content:
+            data_payload = content['data']
+            if isinstance(data_payload, pd.DataFrame):
+                data_payload = {"RESULT": data_payload}
+            
+            for table_name, table_df in data_payload.items():
+                if len(data_payload) > 1: st.markdown(f"**📄 {table_name}**")
+                # 强制使用 Streamlit 的 dataframe，但外部容器已经变黑
+                st.dataframe(format_df_for_display(table_df.head(PREVIEW_ROW_LIMIT)), use_container_width=True)
+                
+                csv = table_df.head(EXPORT_ROW_LIMIT).to_csv(index=False).encode('utf-8-sig')
+                st.download_button(f"📥 EXPORT CSV ({table_name})", csv, f"{table_name}.csv", "text/csv", key=f"dl_simple_{key_prefix}_{table_name}")
+            render_chart_block(data_payload, content.get('chart'), content.get('chart_key'))
+
+    elif 'intent' in content:
+        st.markdown('<div class="step-header">01 // INTENT PARSING</div>', unsafe_allow_html=True)
+        st.markdown(content.get('intent', ''))
+        if content.get('reused'): st.caption("♻️ PLAN REUSED FROM SNIPPET LIBRARY")
+        if content.get('derived_from'): st.caption(f"↳ COMPUTED FROM PRIOR RESULT: {lineage_text(content['derived_from'])}")
+        
+        if content.get('angles_data') or content.get('errors'):
+            st.markdown('<div class="step-header">02 // MULTI-VECTOR ANALYSIS</div>', unsafe_allow_html=True)
+            for i, angle in enumerate(content.get('angles_data', [])):
+                with st.container():
+                    st.markdown(f"""
+                    <div class="tech-card">
+                        <div class="angle-title">{angle['title']}</div>
+                        <div class="angle-desc">{angle['desc']}</div>
+                    </div>
+                    """, unsafe_allow_html=True)
+                    
+                    st.dataframe(format_df_for_display(angle['data'].head(PREVIEW_ROW_LIMIT)), use_container_width=True)
+                    render_chart_block(angle['data'], angle.get('chart'), angle.get('chart_key'))
+                    
+                    csv = angle['data'].head(EXPORT_ROW_LIMIT).to_csv(index=False).encode('utf-8-sig')
+                    col1, col2 = st.columns([1, 4])
+                    with col1:
+                        st.download_button(f"📥 DOWNLOAD", csv, f"angle_{i}_hist.csv", "text/csv", key=f"dl_hist_{key_prefix}_{i}")
+                    st.markdown(f'<div class="mini-insight">💡 <b>DEEP DIVE:</b> {angle["explanation"]}</div>', unsafe_allow_html=True)
+            for err in content.get('errors', []):
+                st.markdown(f"""
+                <div class="tech-card">
+                    <div class="angle-title">{err['title']}</div>
+                    <div class="angle-desc">{err['desc']}</div>
+                </div>
+                """, unsafe_allow_html=True)
+                st.error(err['error'])
+        
+        if 'insight' in content:
+            st.markdown('<div class="step-header">03 // SYNTHESIZED INSIGHT</div>', unsafe_allow_html=True)
+            st.markdown(f'<div class="insight-box">{content.get("insight", "")}</div>', unsafe_allow_html=True)
+
+def adopt_finished_job():
+    # 后台任务结束后由主脚本把结果写回会话 (后台线程不能直接碰 session_state)
+    manager = get_job_manager()
+    job = manager.get(st.session_state.active_job)
+    if job is None or not job.finished: return
+    if job.status == 'done' and job.message:
+        st.session_state.messages.append(job.message)
+    elif job.status == 'failed':
+        st.session_state.messages.append({"role": "assistant", "type": "text", "content": f"⚠️ SYSTEM FAILURE: {job.error}"})
+    manager.forget(job.id)
+    st.session_state.active_job = None
+
+@st.fragment(run_every=JOB_POLL_INTERVAL_S)
+def render_job_progress(job_id):
+    # 局部 rerun 轮询进度，阶段结果一到就渲染；任务结束后触发整页 rerun 认领结果
+    job = get_job_manager().get(job_id)
+    if job is None: return
+    if job.finished:
+        st.rerun()
+    stage, partial = job.snapshot()
+    with st.chat_message("assistant"):
+        st.markdown(f'<div class="mini-insight">⏳ {stage or "QUEUED..."} [{time.time() - job.started:.0f}s]</div>', unsafe_allow_html=True)
+        render_report_block(partial, key_prefix=f"live_{job_id}")
+
 # -----------------------------------------------------------------------------
 # 4. 主程序 (Main Execution)
 # -----------------------------------------------------------------------------
@@ -569,6 +561,10 @@ if "last_query_draft" not in st.session_state:
     st.session_state.last_query_draft = ""
 if "is_interrupted" not in st.session_state:
     st.session_state.is_interrupted = False
+if "active_job" not in st.session_state:
+    st.session_state.active_job = None
+if "session_id" not in st.session_state:
+    st.session_state.session_id = uuid.uuid4().hex[:8]
 
 client = get_client()
 
@@ -576,11 +572,13 @@ if not client:
     st.warning("⚠️ API KEY MISSING. PLEASE CONFIGURE SECRETS.")
     st.stop()
 
-df = load_data()
+workspace = load_workspace()
+df = workspace['df'] if workspace else None
+warm_job = start_warm_reports(workspace['version']) if workspace else None
 
 if df is not None:
-    time_context = analyze_time_structure(df)
-    meta_data = build_metadata(df, time_context)
+    time_context = workspace['time_context']
+    meta_data = workspace['meta_data']
     
     # --- Sidebar: Control Panel ---
     with st.sidebar:
@@ -599,87 +597,54 @@ if df is not None:
         """, unsafe_allow_html=True)
 
         if st.button("🗑️ PURGE MEMORY", use_container_width=True):
+            if st.session_state.active_job:
+                get_job_manager().cancel(st.session_state.active_job)
+                get_job_manager().forget(st.session_state.active_job)
+                st.session_state.active_job = None
             st.session_state.messages = []
             st.session_state.last_query_draft = ""
             st.session_state.is_interrupted = False
             st.rerun()
 
+        rerun_ms = startup.record_timing("rerun_overhead_ms", (time.perf_counter() - _RUN_STARTED) * 1000)
+        budget_ms = startup.PERF_BUDGET["rerun_overhead_ms"]
+        st.caption(
+            f"BOOT {startup.BOOT_TIMINGS.get('workspace_s', 0):.2f}s ({startup.BOOT_TIMINGS.get('workspace_source', '-')}) | "
+            f"RERUN {rerun_ms:.0f}ms / {budget_ms:.0f}ms" + (" ⚠️" if rerun_ms > budget_ms else "")
+        )
+        q = SCHEDULER.metrics()
+        st.caption(
+            f"GENAI {q['in_flight']}/{q['max_concurrency']} ACTIVE | QUEUE {q['queued']} "
+            f"(I:{q['queue_depth'].get('interactive', 0)} B:{q['queue_depth'].get('background', 0)}) | "
+            f"RPM {q['rpm_used']}/{q['rpm_cap']} | WAIT avg {q['avg_wait_s']:.1f}s" + (f" | ⏸ 429 {q['paused_s']}s" if q['paused_s'] else "")
+        )
+        if warm_job is not None:
+            warm_total = warm_reports.warm_queries(get_warm_store())
+            st.caption(
+                f"WARM {get_warm_store().ready(workspace['version'], warm_total)}/{len(warm_total)} READY"
+                + (f" | {warm_job.snapshot()[0] or 'RUNNING'}" if not warm_job.finished else f" | {warm_job.status.upper()}")
+            )
+
+    # --- 认领已完成的后台任务 ---
+    adopt_finished_job()
+
     # --- Chat Render ---
     for msg_idx, msg in enumerate(st.session_state.messages):
         with st.chat_message(msg["role"]):
             if msg["type"] == "text":
                 st.markdown(msg["content"])
             elif msg["type"] == "report_block":
-                content = msg["content"]
-                mode = content.get('mode', 'analysis') 
-                
-                if mode == 'simple':
-                    if 'summary' in content:
-                        s = content['summary']
-                        st.markdown(f"""
-                        <div class="summary-box">
-                            <div class="summary-title">⚡ EXECUTION PROTOCOL</div>
-                            <ul class="summary-list">
-                                <li><span class="summary-label">INTENT</span> {s.get('intent', '-')}</li>
-                                <li><span class="summary-label">METRIC</span> {s.get('metrics', '-')}</li>
-                                <li><span class="summary-label">LOGIC</span> {s.get('logic', '-')}</li>
-                            </ul>
-                        </div>
-                        """, unsafe_allow_html=True)
-                    else:
-                        st.success("DATA EXTRACTION COMPLETE")
-                    
-                    if 'data' in content:
-                        data_payload = content['data']
-                        if isinstance(data_payload, pd.DataFrame):
-                            data_payload = {"RESULT": data_payload}
-                        
-                        for table_name, table_df in data_payload.items():
-                            if len(data_payload) > 1: st.markdown(f"**📄 {table_name}**")
-                            # 强制使用 Streamlit 的 dataframe，但外部容器已经变黑
-                            st.dataframe(format_df_for_display(table_df).head(PREVIEW_ROW_LIMIT), use_container_width=True)
-                            
-                            csv = table_df.head(EXPORT_ROW_LIMIT).to_csv(index=False).encode('utf-8-sig')
-                            st.download_button(f"📥 EXPORT CSV ({table_name})", csv, f"{table_name}.csv", "text/csv", key=f"dl_simple_{msg_idx}_{table_name}")
-
-                else:
-                    st.markdown('<div class="step-header">01 // INTENT PARSING</div>', unsafe_allow_html=True)
-                    st.markdown(content.get('intent', ''))
-                    
-                    if 'angles_data' in content:
-                        st.markdown('<div class="step-header">02 // MULTI-VECTOR ANALYSIS</div>', unsafe_allow_html=True)
-                        for i, angle in enumerate(content['angles_data']):
-                            with st.container():
-                                st.markdown(f"""
-                                <div class="tech-card">
-                                    <div class="angle-title">{angle['title']}</div>
-                                    <div class="angle-desc">{angle['desc']}</div>
-                                </div>
-                                """, unsafe_allow_html=True)
-                                
-                                st.dataframe(format_df_for_display(angle['data']).head(PREVIEW_ROW_LIMIT), use_container_width=True)
-                                
-                                csv = angle['data'].head(EXPORT_ROW_LIMIT).to_csv(index=False).encode('utf-8-sig')
-                                col1, col2 = st.columns([1, 4])
-                                with col1:
-                                    st.download_button(f"📥 DOWNLOAD", csv, f"angle_{i}_hist.csv", "text/csv", key=f"dl_hist_{msg_idx}_{i}")
-                                st.markdown(f'<div class="mini-insight">💡 <b>DEEP DIVE:</b> {angle["explanation"]}</div>', unsafe_allow_html=True)
-                    
-                    st.markdown('<div class="step-header">03 // SYNTHESIZED INSIGHT</div>', unsafe_allow_html=True)
-                    st.markdown(f'<div class="insight-box">{content.get("insight", "")}</div>', unsafe_allow_html=True)
+                render_report_block(msg["content"], key_prefix=msg_idx)
 
     # --- Suggestion Chips ---
     if len(st.session_state.messages) == 0 and not st.session_state.is_interrupted:
         st.markdown("<br><br>", unsafe_allow_html=True)
         st.markdown("<div style='text-align:center; color:var(--tech-cyan); margin-bottom:20px; font-family:var(--tech-font-mono)'>// INITIATE QUERY SEQUENCE</div>", unsafe_allow_html=True)
-        col1, col2, col3 = st.columns(3)
-        q1, q2, q3 = "What is the market share by province?", "Which products have high YoY growth?", "Analyze regional performance trends."
-        if col1.button(f"🗺️ **MARKET SHARE**\n\n{q1}", use_container_width=True):
-            st.session_state.messages.append({"role": "user", "type": "text", "content": q1}); st.rerun()
-        if col2.button(f"📈 **GROWTH RATE**\n\n{q2}", use_container_width=True):
-            st.session_state.messages.append({"role": "user", "type": "text", "content": q2}); st.rerun()
-        if col3.button(f"📊 **REGIONAL TREND**\n\n{q3}", use_container_width=True):
-            st.session_state.messages.append({"role": "user", "type": "text", "content": q3}); st.rerun()
+        # 建议问题与后台预计算共用同一份清单，预计算完成后点击即出报告
+        for col, (icon, label, q) in zip(st.columns(len(warm_reports.SUGGESTED_QUERIES)), warm_reports.SUGGESTED_QUERIES):
+            ready = " ⚡" if get_warm_store().get(workspace['version'], q) else ""
+            if col.button(f"{icon} **{label}**{ready}\n\n{q}", use_container_width=True):
+                st.session_state.messages.append({"role": "user", "type": "text", "content": q}); st.rerun()
 
     # --- Input Area ---
     if st.session_state.is_interrupted:
@@ -694,210 +659,40 @@ if df is not None:
         st.button("🚀 RESUBMIT", on_click=submit_edit, type="primary")
 
     if not st.session_state.is_interrupted:
-        if query_input := st.chat_input("🔎 ENTER COMMAND..."):
+        # 有问题在处理时锁定输入框，避免新问题排在未完成的任务后面被吞掉
+        busy = st.session_state.active_job is not None or (st.session_state.messages and st.session_state.messages[-1]["role"] == "user")
+        if query_input := st.chat_input("🔎 ENTER COMMAND...", disabled=bool(busy)):
             st.session_state.last_query_draft = query_input
             st.session_state.messages.append({"role": "user", "type": "text", "content": query_input})
             st.rerun()
 
-    # --- AI Processing Logic ---
+    # --- AI Processing Logic (后台任务) ---
     if st.session_state.messages and st.session_state.messages[-1]["role"] == "user" and not st.session_state.is_interrupted:
-        current_query = st.session_state.messages[-1]["content"]
-        history_context_str = get_history_context(st.session_state.messages, turn_limit=3)
-        stop_btn_placeholder = st.empty()
+        job_manager = get_job_manager()
+        job = job_manager.get(st.session_state.active_job)
+        if job is None:
+            current_query = st.session_state.messages[-1]["content"]
+            warm_store = get_warm_store()
+            warm_store.record(current_query)
+            # 预计算命中: 直接展示完整报告 (追问依赖上下文，不走预计算)
+            warm = None if is_followup(current_query) else warm_store.get(workspace['version'], current_query)
+            if warm is not None:
+                st.session_state.messages.append(warm_reports.serve(warm))
+                st.rerun()
+            job = job_manager.submit(
+                run_query, client, current_query, workspace,
+                history_str=get_history_context(st.session_state.messages, turn_limit=3),
+                library=get_snippet_library(),
+                session_id=st.session_state.session_id,
+                prior=collect_prior_results(st.session_state.messages, workspace['version'])
+            )
+            st.session_state.active_job = job.id
         
-        if stop_btn_placeholder.button("⏹️ ABORT SEQUENCE", type="primary", use_container_width=True):
+        if st.button("⏹️ ABORT SEQUENCE", type="primary", use_container_width=True):
+            # 取消令牌: 放弃排队 / 退避中的 LLM 请求，kill 正在执行的代码子进程
+            job_manager.cancel(job.id)
+            job_manager.forget(job.id)
+            st.session_state.active_job = None
             st.session_state.is_interrupted = True; st.rerun()
 
-        with st.chat_message("assistant"):
-            try:
-                # 意图识别
-                intent_type = "analysis" 
-                with st.spinner("🔄 PARSING INTENT..."):
-                    router_prompt = f"""
-                    Based on user query: "{current_query}" and history.
-                    【History】:{history_context_str}
-                    Classify into:
-                    1. "simple": Simple data retrieval, sorting, ranking, basic calc.
-                    2. "analysis": Open-ended, insight seeking, market pattern.
-                    3. "irrelevant": Chit-chat not related to data.
-                    Output JSON: {{"type": "simple" OR "analysis" OR "irrelevant"}}
-                    """
-                    router_resp = safe_generate_content(
-                        client, "gemini-2.0-flash", router_prompt, config=types.GenerateContentConfig(response_mime_type="application/json")
-                    )
-                    try: intent_type = json.loads(router_resp.text).get('type', 'analysis')
-                    except: intent_type = 'analysis'
-
-                mat_list = time_context.get('mat_list')
-                mat_list_prior = time_context.get('mat_list_prior')
-                ytd_list = time_context.get('ytd_list')
-                ytd_list_prior = time_context.get('ytd_list_prior')
-
-                if intent_type == 'irrelevant':
-                    st.warning("⚠️ OUT OF SCOPE")
-                    st.session_state.messages.append({"role": "assistant", "type": "text", "content": "Query unrelated to dataset coverage."})
-
-                # ================= [Simple Mode] =================
-                elif intent_type == 'simple':
-                    with st.spinner("⚡ GENERATING CODE BLOCK..."):
-                        simple_prompt = f"""
-                        You are a Pandas Expert. User Request: "{current_query}"
-                        【Meta】{meta_data}
-                        【History】{history_context_str}
-                        【Time】MAT: {mat_list}, YTD: {ytd_list}
-                        
-                        【RULES】
-                        1. Data source: `df` only.
-                        2. Filter explicitly (e.g., `df[df['Province']=='Hainan']`).
-                        3. Assign result dict to `results`.
-                        4. NO PLOTTING.
-                        
-                        Output JSON: {{ 
-                            "summary": {{ "intent": "desc", "metrics": "list", "logic": "desc" }}, 
-                            "code": "df_sub = df[...]\nresults = {{'Title': df_sub}}" 
-                        }}
-                        """
-                        simple_resp = safe_generate_content(
-                            client, "gemini-2.0-flash", simple_prompt, config=types.GenerateContentConfig(response_mime_type="application/json")
-                        )
-                        simple_json = json.loads(simple_resp.text)
-                        
-                        execution_context = {
-                            'df': df, 'pd': pd, 'np': np, 'results': {}, 'result': None,
-                            'current_mat': mat_list, 'mat_list': mat_list, 'prior_mat': mat_list_prior,
-                            'mat_list_prior': mat_list_prior, 'ytd_list': ytd_list, 'ytd_list_prior': ytd_list_prior
-                        }
-                        exec(simple_json['code'], execution_context)
-                        
-                        final_results = execution_context.get('results')
-                        if not final_results and execution_context.get('result') is not None:
-                            final_results = {"RESULT": execution_context.get('result')}
-                        
-                        if final_results:
-                            formatted_results = {k: normalize_result(v) for k, v in final_results.items()}
-                            s = simple_json.get('summary', {})
-                            
-                            st.markdown(f"""
-                            <div class="summary-box">
-                                <div class="summary-title">⚡ EXECUTION PROTOCOL</div>
-                                <ul class="summary-list">
-                                    <li><span class="summary-label">INTENT</span> {s.get('intent','-')}</li>
-                                    <li><span class="summary-label">LOGIC</span> {s.get('logic','-')}</li>
-                                </ul>
-                            </div>
-                            """, unsafe_allow_html=True)
-                            
-                            for table_name, table_df in formatted_results.items():
-                                if len(formatted_results) > 1: st.markdown(f"**📄 {table_name}**")
-                                st.dataframe(format_df_for_display(table_df).head(PREVIEW_ROW_LIMIT), use_container_width=True)
-                                csv = table_df.head(EXPORT_ROW_LIMIT).to_csv(index=False).encode('utf-8-sig')
-                                st.download_button(f"📥 EXPORT ({table_name})", csv, f"{table_name}.csv", "text/csv", key=f"dl_simple_{len(st.session_state.messages)}_{table_name}")
-                            
-                            st.session_state.messages.append({
-                                "role": "assistant", "type": "report_block",
-                                "content": { "mode": "simple", "summary": s, "data": formatted_results }
-                            })
-                        else:
-                            st.error("DATA EXTRACTION FAILED")
-                            st.session_state.messages.append({"role": "assistant", "type": "text", "content": "No data found."})
-
-                # ================= [Analysis Mode] =================
-                else:
-                    with st.spinner("🧠 DECOMPOSING QUERY..."):
-                        prompt_plan = f"""
-                        Role: BI Expert. Breakdown: "{current_query}" into 2-5 angles.
-                        Combine Time(MAT/YTD) & Competition.
-                        
-                        【Meta】{meta_data}
-                        【History】{history_context_str}
-                        【Time】MAT: {mat_list}, YTD: {ytd_list}
-                        
-                        【RULES】
-                        1. `df` is the only source.
-                        2. Define all variables explicitly.
-                        3. Assign final df to `result`.
-                        4. Language: Chinese.
-                        
-                        Output JSON: {{ "intent_analysis": "Markdown analysis", "angles": [ {{"title": "Title", "description": "Desc", "code": "..."}} ] }}
-                        """
-                        response_plan = safe_generate_content(client, "gemini-2.0-flash", prompt_plan, config=types.GenerateContentConfig(response_mime_type="application/json"))
-                        reasoning_text, plan_json = parse_response(response_plan.text)
-
-                    if plan_json and 'angles' in plan_json:
-                        st.markdown('<div class="step-header">01 // INTENT PARSING</div>', unsafe_allow_html=True)
-                        st.markdown(plan_json.get('intent_analysis', 'Auto Analysis'))
-                        
-                        angles_data = [] 
-                        st.markdown('<div class="step-header">02 // MULTI-VECTOR ANALYSIS</div>', unsafe_allow_html=True)
-                        
-                        for i, angle in enumerate(plan_json['angles']):
-                            with st.container():
-                                st.markdown(f"""
-                                <div class="tech-card">
-                                    <div class="angle-title">{angle['title']}</div>
-                                    <div class="angle-desc">{angle.get('description','')}</div>
-                                </div>
-                                """, unsafe_allow_html=True)
-                                
-                                try:
-                                    execution_context = {
-                                        'df': df, 'pd': pd, 'np': np, 'result': None,
-                                        'current_mat': mat_list, 'mat_list': mat_list, 'prior_mat': mat_list_prior,
-                                        'mat_list_prior': mat_list_prior, 'ytd_list': ytd_list, 'ytd_list_prior': ytd_list_prior
-                                    }
-                                    exec(angle['code'], execution_context)
-                                    
-                                    if execution_context.get('result') is None:
-                                        for k, v in list(execution_context.items()):
-                                            if isinstance(v, pd.DataFrame) and k != 'df':
-                                                execution_context['result'] = v; break
-                                    
-                                    if execution_context.get('result') is not None:
-                                        res_df = normalize_result(execution_context['result'])
-                                        st.dataframe(format_df_for_display(res_df).head(PREVIEW_ROW_LIMIT), use_container_width=True)
-                                        
-                                        with st.spinner(f"⚡ ANALYZING VECTOR {i+1}..."):
-                                            mini_prompt = f"""
-                                            Interpret this data (200 chars).
-                                            Data:\n{res_df.head(20).to_string()}
-                                            Req: Professional, Business Insight.
-                                            """
-                                            mini_resp = safe_generate_content(client, "gemini-2.0-flash", mini_prompt)
-                                            explanation = mini_resp.text
-                                            st.markdown(f'<div class="mini-insight">💡 <b>DEEP DIVE:</b> {explanation}</div>', unsafe_allow_html=True)
-                                        
-                                        angles_data.append({
-                                            "title": angle['title'], "desc": angle.get('description',''),
-                                            "data": res_df, "explanation": explanation
-                                        })
-                                    else:
-                                        st.error("NO DATA RETURNED")
-                                except Exception as e:
-                                    st.error(f"CODE EXEC ERROR: {e}")
-
-                        if angles_data:
-                            st.markdown('<div class="step-header">03 // SYNTHESIZED INSIGHT</div>', unsafe_allow_html=True)
-                            with st.spinner("🤖 SYNTHESIZING..."):
-                                all_findings = "\n".join([f"[{ad['title']}]: {ad['explanation']}" for ad in angles_data])
-                                final_prompt = f"""
-                                Query: "{current_query}"
-                                Findings: {all_findings}
-                                Generate Final Insight (Markdown). No advice, just facts.
-                                """
-                                resp_final = safe_generate_content(client, "gemini-2.0-flash", final_prompt)
-                                insight_text = resp_final.text
-                                st.markdown(f'<div class="insight-box">{insight_text}</div>', unsafe_allow_html=True)
-                                
-                                st.session_state.messages.append({
-                                    "role": "assistant", "type": "report_block",
-                                    "content": {
-                                        "mode": "analysis", "intent": plan_json.get('intent_analysis', ''),
-                                        "angles_data": angles_data, "insight": insight_text
-                                    }
-                                })
-                    else:
-                        st.error("PLAN GENERATION FAILED")
-            except Exception as e:
-                st.error(f"SYSTEM FAILURE: {e}")
-            finally:
-                stop_btn_placeholder.empty()
+        render_job_progress(job.id)
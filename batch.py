@@ -0,0 +1,185 @@
+import os
+import re
+import sys
+import json
+import time
+import argparse
+import multiprocessing as mp
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import pandas as pd
+
+import engine
+import startup
+from jobs import CancelToken
+from scheduler import SCHEDULER, MAX_CONCURRENCY, RPM_LIMIT
+from snippet_library import SnippetLibrary
+
+# -----------------------------------------------------------------------------
+# 无界面批量报告: 查询文件 → 多进程跑 engine.run_query → Parquet + Markdown
+#   用法: python batch.py queries.txt --out reports/ --workers 4
+#   数据集在主进程加载一次，fork 出的工作进程以写时复制方式共享同一份 df
+# -----------------------------------------------------------------------------
+
+PREVIEW_ROWS = 20
+
+_WORKSPACE = None
+_CLIENT = None
+_LIBRARY = None
+
+
+def read_queries(path):
+    """txt: 每行一个问题；jsonl: {"id": ..., "query": ...}。空行 / # 注释忽略。"""
+    queries = []
+    with open(path, "r", encoding="utf-8") as f:
+        for n, line in enumerate(f, 1):
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            if path.endswith(".jsonl"):
+                item = json.loads(line)
+                queries.append((str(item.get("id", n)), item["query"]))
+            else:
+                queries.append((str(n), line))
+    return queries
+
+
+def _init_worker(file_name, api_key, n_workers):
+    global _WORKSPACE, _CLIENT, _LIBRARY
+    if _WORKSPACE is None:
+        # 非 fork 平台: 各进程从启动快照加载 (仍然不重复 read_excel)
+        _WORKSPACE = startup.warm_workspace(file_name)
+    _CLIENT = engine.make_client(api_key)
+    _LIBRARY = SnippetLibrary(read_only=True)
+    # 全局配额按进程数切分，所有进程合计仍低于限流线
+    SCHEDULER.configure(max(1, MAX_CONCURRENCY // n_workers), max(1, RPM_LIMIT // n_workers))
+
+
+def _safe_name(text, limit=40):
+    return re.sub(r"[^\w-]+", "_", str(text)).strip("_")[:limit] or "table"
+
+
+def _write_frame(frame, path_base):
+    frame = frame.rename(columns=str)
+    try:
+        frame.to_parquet(path_base + ".parquet")
+        return path_base + ".parquet"
+    except (ImportError, TypeError, ValueError, NotImplementedError):
+        # 未安装 pyarrow / fastparquet，或混合类型的 object 列无法转换 (ArrowTypeError / ArrowInvalid /
+        # ArrowNotImplementedError 分别继承这三类内置异常) 时退回 CSV，单张表不拖垮整条问题
+        if os.path.exists(path_base + ".parquet"): os.remove(path_base + ".parquet")
+        frame.to_csv(path_base + ".csv", index=True, encoding="utf-8-sig")
+        return path_base + ".csv"
+
+
+def _md_table(frame, rows=PREVIEW_ROWS):
+    frame = frame.head(rows)
+    if any(n is not None for n in frame.index.names):
+        frame = frame.reset_index()
+    cols = [str(c) for c in frame.columns]
+    lines = ["| " + " | ".join(cols) + " |", "|" + "---|" * len(cols)]
+    for row in frame.itertuples(index=False):
+        lines.append("| " + " | ".join("" if pd.isna(v) else (f"{v:,.4g}" if isinstance(v, float) else str(v)) for v in row) + " |")
+    return "\n".join(lines)
+
+
+def write_report(qid, query, message, out_dir):
+    """把一条 assistant 消息落盘，返回写出的文件列表。"""
+    base = os.path.join(out_dir, _safe_name(qid))
+    files, md = [], [f"# {query}", ""]
+    if message["type"] == "text":
+        md.append(message["content"])
+    elif message["content"].get("mode") == "simple":
+        content = message["content"]
+        s = content.get("summary", {})
+        md += [f"- **INTENT** {s.get('intent', '-')}", f"- **METRIC** {s.get('metrics', '-')}", f"- **LOGIC** {s.get('logic', '-')}", ""]
+        for name, frame in content.get("data", {}).items():
+            files.append(_write_frame(frame, f"{base}__{_safe_name(name)}"))
+            md += [f"## {name}", "", _md_table(frame), ""]
+    else:
+        content = message["content"]
+        md += ["## 01 // INTENT", "", content.get("intent", ""), "", "## 02 // ANALYSIS", ""]
+        for i, angle in enumerate(content.get("angles_data", [])):
+            files.append(_write_frame(angle["data"], f"{base}__angle{i + 1}"))
+            md += [f"### {angle['title']}", "", angle["desc"], "", _md_table(angle["data"]), "", f"> {angle['explanation']}", ""]
+        for err in content.get("errors", []):
+            md += [f"### {err['title']}", "", f"⚠️ {err['error']}", ""]
+        md += ["## 03 // INSIGHT", "", content.get("insight", "")]
+    with open(base + ".md", "w", encoding="utf-8") as f:
+        f.write("\n".join(md))
+    files.append(base + ".md")
+    return files
+
+
+def run_one(qid, query, out_dir):
+    t0 = time.perf_counter()
+    try:
+        # 带令牌才会走子进程执行并套用 EXEC_TIMEOUT_S，卡死的生成代码不会永久占住工作进程
+        message = engine.run_query(
+            _CLIENT, query, _WORKSPACE, library=_LIBRARY, token=CancelToken(), session_id=f"batch-{os.getpid()}"
+        )
+        files = write_report(qid, query, message, out_dir)
+        content = message["content"] if isinstance(message["content"], dict) else {}
+        # 只有拿到结果表的报告算成功；"PLAN GENERATION FAILED" / "No data found." / 超范围回复记为无结果
+        has_data = message["type"] == "report_block" and (content.get("data") or content.get("angles_data"))
+        status = "ok" if has_data else "no_result"
+        error = "" if has_data else (message["content"] if isinstance(message["content"], str) else "no result frames")
+        return {"id": qid, "query": query, "status": status, "mode": content.get("mode", "-"),
+                "reused": bool(content.get("reused")), "seconds": round(time.perf_counter() - t0, 2),
+                "files": len(files), "error": error}
+    except Exception as e:
+        return {"id": qid, "query": query, "status": "failed", "mode": "-", "reused": False,
+                "seconds": round(time.perf_counter() - t0, 2), "files": 0, "error": str(e)}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="ChatBI headless batch reporting")
+    parser.add_argument("queries", help="txt (one query per line) or jsonl ({id, query})")
+    parser.add_argument("--data", default=engine.DATA_FILE)
+    parser.add_argument("--out", default="reports")
+    parser.add_argument("--workers", type=int, default=max(1, min(4, os.cpu_count() or 1)))
+    parser.add_argument("--api-key", default=os.environ.get("GENAI_API_KEY", ""))
+    args = parser.parse_args(argv)
+
+    if not args.api_key:
+        parser.error("GENAI_API_KEY missing (env or --api-key)")
+    os.makedirs(args.out, exist_ok=True)
+    queries = read_queries(args.queries)
+    if not queries:
+        print("no queries found")
+        return 0
+
+    global _WORKSPACE
+    t0 = time.perf_counter()
+    _WORKSPACE = startup.warm_workspace(args.data)
+    load_s = time.perf_counter() - t0
+
+    ctx = mp.get_context("fork") if hasattr(os, "fork") else mp.get_context()
+    rows = []
+    t1 = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=args.workers, mp_context=ctx, initializer=_init_worker,
+                             initargs=(args.data, args.api_key, args.workers)) as pool:
+        futures = [pool.submit(run_one, qid, q, args.out) for qid, q in queries]
+        for fut in as_completed(futures):
+            row = fut.result()
+            rows.append(row)
+            print(f"[{len(rows)}/{len(queries)}] {row['status']:<9} {row['seconds']:>7.2f}s  {row['id']}: {row['query'][:60]}", flush=True)
+    wall_s = time.perf_counter() - t1
+
+    summary = pd.DataFrame(rows).sort_values("id", key=lambda s: s.map(lambda v: (len(v), v)))
+    summary.to_csv(os.path.join(args.out, "summary.csv"), index=False, encoding="utf-8-sig")
+    ok = (summary["status"] == "ok").sum()
+    no_result = (summary["status"] == "no_result").sum()
+    stats = (
+        f"queries {len(rows)} | ok {ok} | no result {no_result} | failed {len(rows) - ok - no_result} | workers {args.workers}\n"
+        f"dataset load {load_s:.2f}s | wall {wall_s:.1f}s | throughput {len(rows) / wall_s * 60 if wall_s else 0:.1f} q/min\n"
+        f"per-query p50 {summary['seconds'].median():.2f}s | p95 {summary['seconds'].quantile(.95):.2f}s | max {summary['seconds'].max():.2f}s"
+    )
+    with open(os.path.join(args.out, "summary.md"), "w", encoding="utf-8") as f:
+        f.write("# Batch Summary\n\n```\n" + stats + "\n```\n\n" + _md_table(summary.drop(columns=["files"]), rows=len(summary)))
+    print(stats)
+    return 0 if ok == len(rows) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,280 @@
+import io
+import json
+import hashlib
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+
+import numpy as np
+import pandas as pd
+
+# -----------------------------------------------------------------------------
+# 声明式图表渲染 (LLM 只给 spec，服务端负责聚合 / 降采样 / 绘制)
+# -----------------------------------------------------------------------------
+
+CHART_TYPES = ("line", "area", "bar", "barh", "pie", "scatter")
+AGG_FUNCS = ("sum", "mean", "max", "min", "count")
+
+MAX_LINE_POINTS = 400      # 时间序列每条线的 LTTB 目标点数
+MAX_CATEGORIES = 12        # 类目轴 Top-N，其余归入 "其他"
+MAX_SERIES = 8             # 系列数上限，其余归入 "其他"
+MAX_SCATTER_POINTS = 2000
+RENDER_TIMEOUT_S = 5.0
+CHART_CACHE_SIZE = 128
+OTHER_LABEL = "其他"
+
+# 中文标签依赖系统 CJK 字体 (packages.txt: fonts-noto-cjk)，否则 matplotlib 回退 DejaVu 画成方框
+CJK_FONTS = ["Noto Sans CJK SC", "SimHei", "Microsoft YaHei", "PingFang SC", "WenQuanYi Zen Hei"]
+PALETTE = ["#00f3ff", "#bc13fe", "#00ff41", "#0077be", "#f59e0b", "#ef4444", "#e0f7fa", "#94a3b8", "#64748b"]
+
+CHART_SPEC_PROMPT = (
+    'Optional "chart": {"type": "line|area|bar|barh|pie|scatter", "x": "col", "y": "col" or ["col", ...], '
+    '"series": "col" or null, "agg": "sum|mean|max|min|count", "title": "short"} '
+    "using columns of the final result (not df). Use null if a table is enough."
+)
+
+_render_pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix="chart")
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+_inflight = {}   # key -> Future，超时后仍在绘制的任务
+
+
+def normalize_spec(spec, df):
+    """校验 LLM 返回的 spec，列名不存在 / 类型不支持时返回 None。"""
+    if not isinstance(spec, dict) or not isinstance(df, pd.DataFrame) or df.empty:
+        return None
+    chart_type = str(spec.get("type", "")).lower()
+    if chart_type not in CHART_TYPES:
+        return None
+
+    data = df.reset_index() if _has_named_index(df) else df
+    cols = [str(c) for c in data.columns]
+    x = spec.get("x")
+    ys = spec.get("y")
+    ys = [ys] if isinstance(ys, str) else list(ys or [])
+    if x not in cols:
+        return None
+    ys = [y for y in ys if y in cols and y != x]
+    if not ys:
+        ys = [c for c in data.columns if c != x and pd.api.types.is_numeric_dtype(data[c])][:1]
+        ys = [str(c) for c in ys]
+    if not ys:
+        return None
+    series = spec.get("series")
+    if series not in cols or series in ys or series == x or len(ys) > 1:
+        series = None
+    agg = str(spec.get("agg") or "sum").lower()
+    if agg not in AGG_FUNCS:
+        agg = "sum"
+    return {
+        "type": chart_type, "x": x, "y": ys, "series": series, "agg": agg,
+        "title": str(spec.get("title") or "")[:80], "table": spec.get("table"),
+    }
+
+
+def _has_named_index(df):
+    return any(n is not None for n in df.index.names)
+
+
+def lttb(x, y, threshold):
+    """Largest-Triangle-Three-Buckets 降采样，返回保留点的下标。"""
+    n = len(y)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    idx = np.empty(threshold, dtype=np.int64)
+    idx[0], idx[-1] = 0, n - 1
+    edges = np.linspace(1, n - 1, threshold - 1).astype(np.int64)
+    a = 0
+    for i in range(threshold - 2):
+        lo, hi = edges[i], max(edges[i + 1], edges[i] + 1)
+        nlo, nhi = edges[i + 1], edges[i + 2] if i + 2 < len(edges) else n
+        nhi = max(nhi, nlo + 1)
+        avg_x, avg_y = x[nlo:nhi].mean(), np.nanmean(y[nlo:nhi]) if np.isfinite(y[nlo:nhi]).any() else np.nan
+        area = np.abs((x[a] - avg_x) * (y[lo:hi] - y[a]) - (x[a] - x[lo:hi]) * (avg_y - y[a]))
+        a = lo + int(np.nanargmax(area)) if np.isfinite(area).any() else lo
+        idx[i + 1] = a
+    return idx
+
+
+def prepare_chart_data(df, spec):
+    """聚合 + 降采样，输出 index 为 x、列为系列的宽表 (绘图只碰这个小表)。"""
+    data = df.reset_index() if _has_named_index(df) else df
+    data = data.rename(columns=str)
+    x, ys, series, agg = spec["x"], spec["y"], spec["series"], spec["agg"]
+
+    if spec["type"] == "scatter":
+        sub = data[[x, ys[0]]].apply(pd.to_numeric, errors="coerce").dropna()
+        if len(sub) > MAX_SCATTER_POINTS:
+            sub = sub.sample(MAX_SCATTER_POINTS, random_state=0)
+        return sub
+
+    values = data[ys].apply(pd.to_numeric, errors="coerce")
+    keys = [data[x].astype(str)] + ([data[series].astype(str)] if series else [])
+    grouped = values.groupby(keys, sort=False).agg(agg)
+    wide = grouped[ys[0]].unstack(series) if series else grouped
+    # 折线 / 面积图的缺失期保留 NaN (画成断点)，不当作真实的 0
+    if spec["type"] not in ("line", "area"):
+        wide = wide.fillna(0)
+
+    if wide.shape[1] > MAX_SERIES:
+        totals = wide.abs().sum().sort_values(ascending=False)
+        keep = list(totals.index[:MAX_SERIES - 1])
+        other = wide.drop(columns=keep).sum(axis=1, min_count=1)
+        wide = wide[keep]
+        wide[OTHER_LABEL] = other
+
+    if spec["type"] in ("line", "area"):
+        wide = wide.sort_index()
+        if len(wide) > MAX_LINE_POINTS:
+            pos = np.arange(len(wide))
+            keep = set()
+            for col in wide.columns:
+                keep.update(lttb(pos, wide[col].to_numpy(dtype=float), max(3, MAX_LINE_POINTS // wide.shape[1])).tolist())
+            keep = sorted(keep)
+            wide = wide.iloc[keep]
+            # 记下保留点在完整序列里的位置，绘图按原间距摆放 (LTTB 依赖这些间隔保持形状)
+            wide.attrs["pos"] = np.asarray(keep, dtype=float)
+    else:
+        limit = MAX_CATEGORIES if spec["type"] != "pie" else MAX_CATEGORIES // 2
+        if len(wide) > limit:
+            order = wide.abs().sum(axis=1).sort_values(ascending=False).index
+            head = wide.loc[order[:limit - 1]]
+            rest = wide.loc[order[limit - 1:]].sum().to_frame(OTHER_LABEL).T
+            wide = pd.concat([head, rest])
+        elif spec["type"] in ("bar", "barh", "pie"):
+            wide = wide.loc[wide.abs().sum(axis=1).sort_values(ascending=False).index]
+    return wide
+
+
+def _draw(wide, spec):
+    import matplotlib
+    from matplotlib.figure import Figure
+
+    if matplotlib.rcParams["font.sans-serif"][:1] != CJK_FONTS[:1]:
+        matplotlib.rcParams["font.sans-serif"] = CJK_FONTS + list(matplotlib.rcParams["font.sans-serif"])
+        matplotlib.rcParams["axes.unicode_minus"] = False
+
+    fig = Figure(figsize=(9, 3.6), dpi=100, facecolor="#050a14")
+    ax = fig.add_subplot(111, facecolor="#0b1220")
+    kind = spec["type"]
+    colors = PALETTE * 4
+
+    if kind == "scatter":
+        ax.scatter(wide.iloc[:, 0], wide.iloc[:, 1], s=8, c=PALETTE[0], alpha=0.6)
+        ax.set_xlabel(wide.columns[0], color="#94a3b8")
+        ax.set_ylabel(wide.columns[1], color="#94a3b8")
+    elif kind == "pie":
+        s = wide.iloc[:, 0].clip(lower=0)
+        ax.pie(s.values, labels=[str(i) for i in s.index], colors=colors[:len(s)],
+               textprops={"color": "#e0f7fa", "fontsize": 8}, wedgeprops={"linewidth": 0.5, "edgecolor": "#050a14"})
+        ax.axis("equal")
+    else:
+        labels = [str(i) for i in wide.index]
+        pos = wide.attrs.get("pos", np.arange(len(labels)))
+        if kind in ("line", "area"):
+            for j, col in enumerate(wide.columns):
+                ax.plot(pos, wide[col].values, color=colors[j], linewidth=1.4, label=str(col))
+                if kind == "area":
+                    ax.fill_between(pos, wide[col].values, color=colors[j], alpha=0.15)
+        else:
+            k = wide.shape[1]
+            width = 0.8 / k
+            bar = ax.barh if kind == "barh" else ax.bar
+            for j, col in enumerate(wide.columns):
+                bar(pos + (j - (k - 1) / 2) * width, wide[col].values, width, color=colors[j], label=str(col))
+        step = max(1, len(labels) // 12)
+        ticks, tick_labels = pos[::step], labels[::step]
+        if kind == "barh":
+            ax.set_yticks(ticks, tick_labels)
+            ax.invert_yaxis()
+        else:
+            ax.set_xticks(ticks, tick_labels, rotation=30 if len(labels) > 6 else 0, ha="right" if len(labels) > 6 else "center")
+        if wide.shape[1] > 1:
+            ax.legend(fontsize=7, facecolor="#0b1220", edgecolor="#1e293b", labelcolor="#e0f7fa")
+
+    ax.tick_params(colors="#94a3b8", labelsize=8)
+    for side in ax.spines.values():
+        side.set_color("#1e293b")
+    if spec.get("title"):
+        ax.set_title(spec["title"], color="#00f3ff", fontsize=10, loc="left")
+    fig.tight_layout()
+
+    buf = io.BytesIO()
+    fig.savefig(buf, format="png", facecolor=fig.get_facecolor())
+    return buf.getvalue()
+
+
+def _cache_key(df, spec):
+    try:
+        digest = pd.util.hash_pandas_object(df, index=True).values.tobytes()
+    except Exception:
+        digest = df.to_csv().encode("utf-8", "ignore")
+    h = hashlib.sha1(digest)
+    h.update(repr(list(df.columns)).encode())
+    h.update(json.dumps(spec, sort_keys=True, ensure_ascii=False, default=str).encode())
+    return h.hexdigest()
+
+
+def chart_key(data, spec):
+    """生成报告时算一次 (整表哈希)，存进报告随消息带着走，渲染时不再重复哈希；无图表时返回 None。
+    data: 单个 DataFrame 或 simple 模式的 {name: df}。"""
+    if not spec: return None
+    if isinstance(data, dict):
+        _, data = pick_chart_table(data, spec)
+    if data is None: return None
+    spec = normalize_spec(spec, data)
+    return _cache_key(data, spec) if spec is not None else None
+
+
+def _store(key, future):
+    # 后台绘图结束时写缓存；失败 / 异常也记为 None，之后的 rerun 不再重复提交
+    try:
+        png = future.result()
+    except Exception:
+        png = None
+    with _cache_lock:
+        _inflight.pop(key, None)
+        _cache[key] = png
+        while len(_cache) > CHART_CACHE_SIZE:
+            _cache.popitem(last=False)
+
+
+def render_chart(df, spec, timeout=RENDER_TIMEOUT_S, key=None):
+    """返回 PNG bytes；spec 无效 / 超时 / 绘图失败时返回 None (图表永远不阻断主流程)。
+    超时的绘图继续在后台跑完并入缓存，同一 key 期间只会有一个任务。"""
+    spec = normalize_spec(spec, df)
+    if spec is None:
+        return None
+    key = key or _cache_key(df, spec)
+    with _cache_lock:
+        if key in _cache:
+            _cache.move_to_end(key)
+            return _cache[key]
+        future = _inflight.get(key)
+        submitted = future is None
+        if submitted:
+            future = _render_pool.submit(lambda: _draw(prepare_chart_data(df, spec), spec))
+            _inflight[key] = future
+    if submitted:
+        # 回调可能在当前线程立即执行，必须在锁外注册
+        future.add_done_callback(lambda f: _store(key, f))
+
+    try:
+        return future.result(timeout=timeout)
+    except FutureTimeout:
+        return None
+    except Exception:
+        return None
+
+
+def pick_chart_table(tables, spec):
+    """simple 模式结果可能有多张表，按 spec['table'] 选择，默认第一张。"""
+    if not tables or not isinstance(spec, dict):
+        return None, None
+    name = spec.get("table")
+    if name in tables:
+        return name, tables[name]
+    name = next(iter(tables))
+    return name, tables[name]
@@ -0,0 +1,614 @@
+import os
+import re
+import json
+
+import numpy as np
+import pandas as pd
+from google import genai
+from google.genai import types
+
+from charts import CHART_SPEC_PROMPT, chart_key
+from jobs import JobCancelled, call_cancellable, run_code
+from snippet_library import fingerprint, is_followup, schema_key
+from profiler import profile_frame
+from primitives import PRIMITIVES_PROMPT, build_primitives
+from value_index import ValueIndex, format_matches
+from scheduler import SCHEDULER, PRIORITY_INTERACTIVE, PRIORITY_BACKGROUND, session_scope
+
+# -----------------------------------------------------------------------------
+# 数据层 (与 Streamlit 解耦，UI / 启动预热 / 命令行共用)
+# -----------------------------------------------------------------------------
+
+DATA_FILE = "hcmdata.xlsx"
+MODEL_NAME = "gemini-2.0-flash"
+SYNTHESIS_PROFILE_BUDGET = 400  # 汇总阶段每个角度只附带最核心的统计
+PRIOR_CODE_CHARS = 300          # 提示词里每个历史结果表附带的来源代码长度上限
+PRIOR_MAX_COLS = 12
+PRIOR_BLOCK_CHARS = 1200        # 【Prior Results】整段长度上限，超出的结果表只列个数
+REFINE_MARKERS = ["只看", "其中", "排序", "only", "among them", "sort"]  # 追问之外常见的 "在上一轮结果上细化" 措辞
+META_FULL_LIST = 12             # 低基数列 (大区 / 渠道) 仍列出全部取值，其余只给样例，具体取值按 query 解析后注入
+META_EXAMPLES = 3
+PREV_REF_RE = re.compile(r"prev_results\[\s*['\"](.+?)['\"]\s*\]")
+
+# 工作区 df 进程内共享 (cache_resource)，执行上下文只给浅拷贝；pandas < 3 默认没有写时复制，
+# 生成代码的原地写入 (df.loc[...] = / fillna(inplace=True)) 会改到所有会话共用的数据，这里统一打开
+if int(pd.__version__.split(".")[0]) < 3:
+    pd.set_option("mode.copy_on_write", True)
+
+
+def load_data(file_name=DATA_FILE):
+    if not os.path.exists(file_name):
+        # 创建一个假数据用于演示
+        data = {
+            '省份': ['江苏', '浙江', '上海', '江苏', '浙江', '上海'],
+            '产品': ['A', 'A', 'A', 'B', 'B', 'B'],
+            'Date': ['2023Q1', '2023Q1', '2023Q1', '2023Q2', '2023Q2', '2023Q2'],
+            'Sales_Value': [1000, 2000, 1500, 1100, 2100, 1600],
+            'Qty': [100, 200, 150, 110, 210, 160]
+        }
+        return pd.DataFrame(data)
+
+    if file_name.endswith('.csv'):
+        df = pd.read_csv(file_name)
+    else:
+        df = pd.read_excel(file_name)
+    df.columns = df.columns.str.strip()
+    for col in df.columns:
+        if any(k in str(col) for k in ['额', '量', 'Sales', 'Qty', '金额']):
+            try:
+                df[col] = pd.to_numeric(
+                    df[col].astype(str).str.replace(',', '', regex=False),
+                    errors='coerce'
+                ).fillna(0)
+            except: pass
+    return df
+
+
+def analyze_time_structure(df):
+    time_col = None
+    for col in df.columns:
+        if '年季' in col or 'Quarter' in col or 'Date' in col:
+            sample = str(df[col].iloc[0])
+            if 'Q' in sample and len(sample) <= 6:
+                time_col = col; break
+    if time_col:
+        sorted_periods = sorted(df[time_col].unique().astype(str))
+        max_q = sorted_periods[-1]
+        min_q = sorted_periods[0]
+        mat_list = sorted_periods[-4:] if len(sorted_periods) >= 4 else sorted_periods
+        is_mat_complete = True
+        mat_list_prior = []
+        if len(sorted_periods) >= 8:
+            mat_list_prior = sorted_periods[-8:-4]
+        elif len(sorted_periods) >= 4:
+            mat_list_prior = sorted_periods[:-4]
+            is_mat_complete = False
+        else:
+            is_mat_complete = False
+        ytd_list, ytd_list_prior = [], []
+        year_match = re.search(r'(\d{4})', str(max_q))
+        if year_match:
+            curr_year = year_match.group(1)
+            try:
+                prev_year = str(int(curr_year) - 1)
+                ytd_list = [p for p in sorted_periods if curr_year in str(p)]
+                expected_priors = [str(p).replace(curr_year, prev_year) for p in ytd_list]
+                ytd_list_prior = [p for p in sorted_periods if p in expected_priors]
+            except: pass
+        return {
+            "col_name": time_col, "all_periods": sorted_periods, "max_q": max_q, "min_q": min_q,
+            "mat_list": mat_list, "mat_list_prior": mat_list_prior, "is_mat_complete": is_mat_complete,
+            "ytd_list": ytd_list, "ytd_list_prior": ytd_list_prior
+        }
+    return {"error": "No Time Column Found"}
+
+
+def build_metadata(df, time_context):
+    info = []
+    info.append(f"【Time Col】: {time_context.get('col_name')}")
+    info.append(f"【Current MAT】: {time_context.get('mat_list')}")
+    info.append(f"【Current YTD】: {time_context.get('ytd_list')}")
+    for col in df.columns:
+        dtype = str(df[col].dtype)
+        uniques = df[col].dropna().unique()
+        desc = f"- `{col}` ({dtype}, {len(uniques)} unique)"
+        if len(uniques) and pd.api.types.is_numeric_dtype(df[col]):
+            desc += f" | RANGE: {uniques.min()} ~ {uniques.max()}"
+        elif len(uniques):
+            vals = uniques.tolist() if len(uniques) <= META_FULL_LIST else uniques[:META_EXAMPLES].tolist()
+            desc += f" | {'VALUES' if len(uniques) <= META_FULL_LIST else 'EX'}: {vals}"
+        info.append(desc)
+    return "\n".join(info)
+
+
+def normalize_result(res):
+    if isinstance(res, pd.DataFrame): return res
+    if isinstance(res, pd.Series): return res.to_frame()
+    if isinstance(res, dict):
+        try: return pd.DataFrame(list(res.items()), columns=['指标', '数值'])
+        except: pass
+    try: return pd.DataFrame([res])
+    except: return pd.DataFrame({"Result": [str(res)]})
+
+
+def normalize_outputs(outputs):
+    """run_code 的 postprocess: 在执行子进程内把 results / result 规整成 DataFrame 再回传。"""
+    results = outputs.get('results')
+    if isinstance(results, dict):
+        outputs['results'] = {k: normalize_result(v) for k, v in results.items()}
+    if outputs.get('result') is not None:
+        outputs['result'] = normalize_result(outputs['result'])
+    return outputs
+
+
+def parse_response(text):
+    reasoning = text
+    json_data = None
+    try:
+        start_idx = text.find('{')
+        end_idx = text.rfind('}')
+        if start_idx != -1 and end_idx != -1 and end_idx > start_idx:
+            potential_json = text[start_idx : end_idx + 1]
+            try:
+                json_data = json.loads(potential_json)
+                reasoning = text[:start_idx].strip()
+            except json.JSONDecodeError: pass
+    except Exception: pass
+    return reasoning, json_data
+
+
+# -----------------------------------------------------------------------------
+# LLM 调用
+# -----------------------------------------------------------------------------
+
+def make_client(api_key):
+    return genai.Client(api_key=api_key, http_options={'api_version': 'v1beta'})
+
+
+def json_config():
+    return types.GenerateContentConfig(response_mime_type="application/json")
+
+
+def safe_generate_content(client, model_name, contents, config=None, retries=3, token=None, priority=PRIORITY_BACKGROUND):
+    base_delay = 5
+    for i in range(retries):
+        # 先过进程级调度 (并发 / RPM / 会话公平)；槽位在请求真正结束时才释放
+        ticket = SCHEDULER.acquire(priority=priority, token=token)
+        started = []
+
+        def call():
+            started.append(True)
+            try:
+                return client.models.generate_content(model=model_name, contents=contents, config=config)
+            finally:
+                SCHEDULER.release(ticket)
+
+        try:
+            return call_cancellable(call, token)
+        except JobCancelled:
+            # 拿到槽位后、请求发出前被取消: call 不会再执行，由这里归还槽位 (release 可重复调用)
+            if not started: SCHEDULER.release(ticket)
+            raise
+        except Exception as e:
+            error_str = str(e)
+            if "429" in error_str or "RESOURCE_EXHAUSTED" in error_str:
+                if i < retries - 1:
+                    # 全局暂停放行，下一次 acquire 自然等到暂停结束 (可取消)
+                    SCHEDULER.report_throttle(base_delay * (2 ** i))
+                    continue
+            raise e
+
+
+def get_history_context(messages, turn_limit=3):
+    if len(messages) <= 1: return "无历史对话。"
+    recent_msgs = messages[:-1]
+    valid_msgs = [m for m in recent_msgs if m['type'] in ['text', 'report_block']]
+    slice_start = max(0, len(valid_msgs) - (turn_limit * 2))
+    target_msgs = valid_msgs[slice_start:]
+    context_list = []
+    for msg in target_msgs:
+        role = "User" if msg['role'] == 'user' else "AI"
+        content_str = ""
+        if msg['type'] == 'text':
+            content_str = msg['content']
+        elif msg['type'] == 'report_block':
+            data = msg['content']
+            mode = data.get('mode', 'analysis')
+            if mode == 'simple':
+                s = data.get('summary', {})
+                content_str = f"[History Data] Intent: {s.get('intent')}, Logic: {s.get('logic')}"
+            else:
+                intent = data.get('intent', '无意图')
+                insight = data.get('insight', '无洞察')
+                angles_summary = [f"<{a['title']}: {a['explanation']}>" for a in data.get('angles_data', [])]
+                content_str = f"[History Analysis] Intent: {intent} | Findings: {'; '.join(angles_summary)} | Insight: {insight}"
+        context_list.append(f"{role}: {content_str}")
+    return "\n".join(context_list)
+
+
+# -----------------------------------------------------------------------------
+# 查询管线: router → code → exec → insight (不依赖 Streamlit，进度通过 progress 回调上报)
+# -----------------------------------------------------------------------------
+
+def collect_prior_results(messages, version=None):
+    """最近一条报告的结果表 → {"frames", "lineage"}；追问直接在这些小中间结果上继续算，不必重扫 df。"""
+    for msg in reversed(messages):
+        if msg.get('type') != 'report_block': continue
+        content = msg['content']
+        # 数据集刷新后旧结果已失效
+        if version is not None and content.get('version', version) != version: break
+        base = {"query": content.get('query', ''), "derived_from": content.get('derived_from', [])}
+        frames, lineage = {}, {}
+        if content.get('mode') == 'simple':
+            for name, frame in content.get('data', {}).items():
+                frames[name] = frame
+                lineage[name] = {**base, "code": content.get('code', '')}
+        else:
+            for angle in content.get('angles_data', []):
+                frames[angle['title']] = angle['data']
+                lineage[angle['title']] = {**base, "code": angle.get('code', '')}
+        if not frames: break
+        if 'RESULT' not in frames:
+            first = next(iter(frames))
+            frames['RESULT'] = frames[first]
+            lineage['RESULT'] = {**lineage[first], "alias_of": first}
+        return {"frames": frames, "lineage": lineage}
+    return {"frames": {}, "lineage": {}}
+
+
+def describe_prior_results(prior, budget=PRIOR_BLOCK_CHARS):
+    # 只给结构和来历 (形状 / 列 / 产生它的问题与代码)，不给数据本身；总长按 budget 封顶
+    lines, used = [], 0
+    names = list(prior['frames'])
+    for i, name in enumerate(names):
+        frame = prior['frames'][name]
+        lin = prior['lineage'].get(name, {})
+        cols = [str(c) for c in frame.columns]
+        col_str = ", ".join(cols[:PRIOR_MAX_COLS]) + (f", …(+{len(cols) - PRIOR_MAX_COLS})" if len(cols) > PRIOR_MAX_COLS else "")
+        index_names = [str(n) for n in frame.index.names if n is not None]
+        line = f"- prev_results['{name}']: {len(frame)} rows | cols: {col_str}" + (f" | index: {', '.join(index_names)}" if index_names else "")
+        if lin.get('alias_of'):
+            line += f" | alias of prev_results['{lin['alias_of']}']"
+        else:
+            line += f" | from query \"{lin.get('query', '')}\""
+            if lin.get('derived_from'):
+                line += " | derived from " + ", ".join(f"'{d['frame']}' of \"{d['query']}\"" for d in lin['derived_from'])
+            code = re.sub(r"\s+", " ", lin.get('code') or "").strip()
+            if code:
+                line += f"\n  code: {code[:PRIOR_CODE_CHARS]}" + ("…" if len(code) > PRIOR_CODE_CHARS else "")
+        if lines and used + len(line) > budget:
+            lines.append(f"- …{len(names) - i} more frames in prev_results")
+            break
+        lines.append(line)
+        used += len(line)
+    return "\n".join(lines)
+
+
+def _refines_prior(query, prior, workspace):
+    # 追问措辞，或提到的取值出现在上一轮的问题 / 结果表里，才算在上一轮结果上细化
+    if is_followup(query) or any(m in query.lower() for m in REFINE_MARKERS):
+        return True
+    index = get_value_index(workspace)
+    mentioned = {(m['col'], m['value']) for m in index.resolve(query) if m['how'] != 'fuzzy'}
+    if not mentioned:
+        return False
+    past = {(m['col'], m['value']) for lin in prior['lineage'].values() for m in index.resolve(lin.get('query', '')) if m['how'] != 'fuzzy'}
+    if mentioned & past:
+        return True
+    values = [v for _, v in mentioned]
+    return any(frame.isin(values).any().any() or frame.index.isin(values).any() for frame in prior['frames'].values())
+
+
+def _prior_prompt(prior, query=None, workspace=None):
+    """返回 (数据源规则, 【Prior Results】段落)；没有历史结果或与上一轮无关的新问题保持原提示词不变。"""
+    if not prior or not prior.get('frames'):
+        return "`df` only.", ""
+    if workspace is not None and not _refines_prior(query, prior, workspace):
+        return "`df` only.", ""
+    block = f"""
+    【Prior Results】(frames from the previous answer, already in scope as dict `prev_results`):
+    {describe_prior_results(prior)}
+    If the request refines the previous answer (filter / sort / top-N / column subset / re-rank / ratio of existing cols)
+    and every needed row and column is in one of these frames, compute from `prev_results[...]` instead of rescanning `df`.
+    Otherwise (new dimension, new period, rows filtered out earlier) use `df`."""
+    return "`df` or `prev_results` (see 【Prior Results】).", block
+
+
+def prior_refs(code, prior):
+    # 从生成代码里找出引用了哪些历史结果表，记入血缘
+    if not prior or not code: return []
+    names = dict.fromkeys(n for n in PREV_REF_RE.findall(code) if n in prior['frames'])
+    return [{"frame": n, "query": prior['lineage'].get(n, {}).get('query', '')} for n in names]
+
+
+def get_value_index(workspace):
+    # 启动预热时已随快照构建；命令行等其他入口按需补建
+    if 'value_index' not in workspace:
+        workspace['value_index'] = ValueIndex(workspace['df'])
+    return workspace['value_index']
+
+
+def get_primitives(workspace):
+    # 每个数据集版本只构建一次 (时间窗口映射缓存在闭包里)
+    if 'primitives' not in workspace:
+        workspace['primitives'] = build_primitives(workspace['df'], workspace['time_context'])
+    return workspace['primitives']
+
+
+def get_execution_base(workspace):
+    """同一数据集版本所有执行共用的基础上下文 (常驻执行进程按对象身份识别，必须缓存复用)。"""
+    if 'exec_base' not in workspace:
+        tc = workspace['time_context']
+        base = {
+            'df': workspace['df'], 'pd': pd, 'np': np,
+            'current_mat': tc.get('mat_list'), 'mat_list': tc.get('mat_list'), 'prior_mat': tc.get('mat_list_prior'),
+            'mat_list_prior': tc.get('mat_list_prior'), 'ytd_list': tc.get('ytd_list'), 'ytd_list_prior': tc.get('ytd_list_prior'),
+        }
+        base.update(get_primitives(workspace))
+        workspace['exec_base'] = base
+    return workspace['exec_base']
+
+
+def execution_extra(prior=None, **extra):
+    # 每次执行的附加变量: 历史结果给浅拷贝，生成代码原地修改不会污染会话里的消息
+    ctx = {'result': None, 'prev_results': {k: v.copy(deep=False) for k, v in ((prior or {}).get('frames') or {}).items()}}
+    ctx.update(extra)
+    return ctx
+
+
+def route_query(client, query, history_str, token=None):
+    router_prompt = f"""
+    Based on user query: "{query}" and history.
+    【History】:{history_str}
+    Classify into:
+    1. "simple": Simple data retrieval, sorting, ranking, basic calc.
+    2. "analysis": Open-ended, insight seeking, market pattern.
+    3. "irrelevant": Chit-chat not related to data.
+    Output JSON: {{"type": "simple" OR "analysis" OR "irrelevant"}}
+    """
+    router_resp = safe_generate_content(client, MODEL_NAME, router_prompt, config=json_config(), token=token, priority=PRIORITY_INTERACTIVE)
+    try: return json.loads(router_resp.text).get('type', 'analysis')
+    except: return 'analysis'
+
+
+def generate_simple_code(client, query, workspace, history_str, token=None, prior=None):
+    tc = workspace['time_context']
+    source_rule, prior_block = _prior_prompt(prior, query, workspace)
+    simple_prompt = f"""
+    You are a Pandas Expert. User Request: "{query}"
+    【Meta】{workspace['meta_data']}
+    【Matched Values】(entities in the request resolved against the dataset)
+    {format_matches(get_value_index(workspace).resolve(query))}
+    【History】{history_str}
+    【Time】MAT: {tc.get('mat_list')}, YTD: {tc.get('ytd_list')}
+    【Helpers】{PRIMITIVES_PROMPT}
+    {prior_block}
+
+    【RULES】
+    1. Data source: {source_rule}
+    2. Filter explicitly with the exact literals from 【Matched Values】 (e.g., `df[df['省份']=='海南']`, never the English name).
+    3. Assign result dict to `results`.
+    4. Use 【Helpers】 for MAT/YTD totals, YoY, share, growth contribution, CAGR, trend (filter via `data=`).
+    5. NO PLOTTING CODE (no matplotlib/seaborn). Charts are declared via `chart` and rendered server-side.
+    6. {CHART_SPEC_PROMPT} Add "table" to pick a key of `results`.
+
+    Output JSON: {{
+        "summary": {{ "intent": "desc", "metrics": "list", "logic": "desc" }},
+        "code": "df_sub = df[...]\nresults = {{'Title': df_sub}}",
+        "chart": null
+    }}
+    """
+    simple_resp = safe_generate_content(client, MODEL_NAME, simple_prompt, config=json_config(), token=token, priority=PRIORITY_INTERACTIVE)
+    return json.loads(simple_resp.text)
+
+
+def generate_analysis_plan(client, query, workspace, history_str, token=None, prior=None):
+    tc = workspace['time_context']
+    source_rule, prior_block = _prior_prompt(prior, query, workspace)
+    prompt_plan = f"""
+    Role: BI Expert. Breakdown: "{query}" into 2-5 angles.
+    Combine Time(MAT/YTD) & Competition.
+
+    【Meta】{workspace['meta_data']}
+    【Matched Values】(entities in the request resolved against the dataset)
+    {format_matches(get_value_index(workspace).resolve(query))}
+    【History】{history_str}
+    【Time】MAT: {tc.get('mat_list')}, YTD: {tc.get('ytd_list')}
+    【Helpers】{PRIMITIVES_PROMPT}
+    {prior_block}
+
+    【RULES】
+    1. Source: {source_rule}
+    2. Define all variables explicitly. Filter with the exact literals from 【Matched Values】.
+    3. Assign final df to `result`.
+    4. Language: Chinese.
+    5. Use 【Helpers】 for MAT/YTD totals, YoY, share, growth contribution, CAGR, trend (filter via `data=`) instead of re-deriving them.
+    6. NO PLOTTING CODE. Per angle, {CHART_SPEC_PROMPT}
+
+    Output JSON: {{ "intent_analysis": "Markdown analysis", "angles": [ {{"title": "Title", "description": "Desc", "code": "...", "chart": null}} ] }}
+    """
+    response_plan = safe_generate_content(client, MODEL_NAME, prompt_plan, config=json_config(), token=token, priority=PRIORITY_INTERACTIVE)
+    _, plan_json = parse_response(response_plan.text)
+    return plan_json
+
+
+def _profile_text(df, budget=None):
+    # 画像失败 (结构异常的结果表) 时退回纯文本预览，不让单个角度因摘要出错被丢弃
+    try:
+        return profile_frame(df) if budget is None else profile_frame(df, budget=budget)
+    except Exception:
+        return pd.DataFrame(df).head(20).to_string()
+
+
+def interpret_result(client, res_df, token=None):
+    mini_prompt = f"""
+    Interpret this data (200 chars).
+    Data profile (full result, pre-aggregated):\n{_profile_text(res_df)}
+    Req: Professional, Business Insight.
+    """
+    return safe_generate_content(client, MODEL_NAME, mini_prompt, token=token).text
+
+
+def synthesize_insight(client, query, angles_data, token=None):
+    all_findings = "\n".join([
+        f"[{ad['title']}]: {ad['explanation']}\n{_profile_text(ad['data'], SYNTHESIS_PROFILE_BUDGET)}"
+        for ad in angles_data
+    ])
+    final_prompt = f"""
+    Query: "{query}"
+    Findings: {all_findings}
+    Generate Final Insight (Markdown). No advice, just facts.
+    """
+    return safe_generate_content(client, MODEL_NAME, final_prompt, token=token).text
+
+
+def _text_message(text):
+    return {"role": "assistant", "type": "text", "content": text}
+
+
+def run_simple_flow(client, query, workspace, history_str, report, step, token=None, snippet_payload=None, prior=None):
+    """返回 (simple_json, reused)；结果写入 report。"""
+    step("⚡ GENERATING CODE BLOCK...")
+    reused = snippet_payload is not None
+    simple_json = snippet_payload if reused else generate_simple_code(client, query, workspace, history_str, token, prior)
+    step("⚙️ EXECUTING CODE BLOCK...")
+    try:
+        outputs = run_code(simple_json['code'], get_execution_base(workspace), execution_extra(prior, results={}), token, postprocess=normalize_outputs)
+    except JobCancelled:
+        raise
+    except Exception:
+        if not reused: raise
+        # 复用片段在当前参数下失败: 回退到正常生成
+        reused = False
+        report['snippet_failed'] = True
+        step("⚡ GENERATING CODE BLOCK...")
+        simple_json = generate_simple_code(client, query, workspace, history_str, token, prior)
+        outputs = run_code(simple_json['code'], get_execution_base(workspace), execution_extra(prior, results={}), token, postprocess=normalize_outputs)
+
+    final_results = outputs.get('results')
+    if not final_results and outputs.get('result') is not None:
+        final_results = {"RESULT": outputs.get('result')}
+    if final_results:
+        data = {k: normalize_result(v) for k, v in final_results.items()}
+        report.update({
+            "summary": simple_json.get('summary', {}),
+            "data": data, "chart": simple_json.get('chart'), "chart_key": chart_key(data, simple_json.get('chart')), "reused": reused,
+            "code": simple_json.get('code', ''), "derived_from": prior_refs(simple_json.get('code'), prior),
+        })
+    return simple_json, reused
+
+
+def _execute_angles(client, plan_json, workspace, report, step, token=None, prior=None):
+    report.update({"intent": plan_json.get('intent_analysis', 'Auto Analysis'), "angles_data": [], "errors": []})
+    step("📡 MULTI-VECTOR ANALYSIS...")
+    for i, angle in enumerate(plan_json['angles']):
+        step(f"⚙️ EXECUTING VECTOR {i+1}...")
+        try:
+            outputs = run_code(angle['code'], get_execution_base(workspace), execution_extra(prior), token, postprocess=normalize_outputs)
+            res = outputs.get('result')
+            if res is None: res = outputs.get('fallback_frame')
+            if res is None:
+                report['errors'].append({"title": angle['title'], "desc": angle.get('description', ''), "error": "NO DATA RETURNED"})
+                continue
+            res_df = normalize_result(res)
+            step(f"⚡ ANALYZING VECTOR {i+1}...")
+            explanation = interpret_result(client, res_df, token)
+            report['angles_data'].append({
+                "title": angle['title'], "desc": angle.get('description', ''),
+                "data": res_df, "explanation": explanation, "chart": angle.get('chart'),
+                "chart_key": chart_key(res_df, angle.get('chart')), "code": angle['code']
+            })
+        except JobCancelled:
+            raise
+        except Exception as e:
+            report['errors'].append({"title": angle['title'], "desc": angle.get('description', ''), "error": f"CODE EXEC ERROR: {e}"})
+
+
+def run_analysis_flow(client, query, workspace, history_str, report, step, token=None, snippet_payload=None, prior=None):
+    """返回 (plan_json, reused, all_angles_ok)；角度结果逐个写入 report 以便前端增量渲染。"""
+    reused = snippet_payload is not None
+    plan_json = snippet_payload
+    if not reused:
+        step("🧠 DECOMPOSING QUERY...")
+        plan_json = generate_analysis_plan(client, query, workspace, history_str, token, prior)
+    if not plan_json or 'angles' not in plan_json:
+        return plan_json, reused, False
+
+    report['reused'] = reused
+    _execute_angles(client, plan_json, workspace, report, step, token, prior)
+    if reused and report['errors']:
+        # 复用计划在当前参数下有角度失败: 回退到正常生成 (与 simple 模式一致)
+        reused = False
+        report.update({"reused": False, "snippet_failed": True})
+        step("🧠 DECOMPOSING QUERY...")
+        plan_json = generate_analysis_plan(client, query, workspace, history_str, token, prior)
+        if not plan_json or 'angles' not in plan_json:
+            return plan_json, reused, False
+        _execute_angles(client, plan_json, workspace, report, step, token, prior)
+
+    report['derived_from'] = prior_refs("\n".join(a['code'] for a in report['angles_data']), prior)
+    if report['angles_data']:
+        step("🤖 SYNTHESIZING...")
+        report['insight'] = synthesize_insight(client, query, report['angles_data'], token)
+    return plan_json, reused, not report['errors']
+
+
+def run_query(client, query, workspace, history_str="无历史对话。", library=None, token=None, progress=None, session_id=None, prior=None):
+    """完整问答管线，返回一条 assistant 消息 (与 st.session_state.messages 结构一致)。
+    prior: collect_prior_results() 的结果，上一轮的结果表以 prev_results 暴露给生成代码。"""
+    with session_scope(session_id):
+        return _run_query(client, query, workspace, history_str, library, token, progress, prior)
+
+
+def _run_query(client, query, workspace, history_str, library, token, progress, prior=None):
+    # query / version 用于下一轮追问的结果血缘与失效判断
+    report = {"query": query, "version": workspace.get('version')}
+
+    def step(stage):
+        if token is not None: token.check()
+        if progress is not None: progress(stage, report)
+
+    # 复用库: 指纹一致的问题直接套用历史成功代码，跳过路由与代码生成
+    snippet, snippet_payload = None, None
+    query_fp, data_schema, followup = None, None, is_followup(query)
+    if library is not None:
+        data_schema = schema_key(workspace['df'])
+        query_fp = fingerprint(query, get_value_index(workspace))
+        if not followup:
+            snippet = library.lookup(query_fp, schema_key=data_schema)
+            if snippet:
+                snippet_payload = library.instantiate(snippet, query_fp)
+
+    if snippet_payload is not None:
+        intent_type = snippet['mode']
+    else:
+        step("🔄 PARSING INTENT...")
+        intent_type = route_query(client, query, history_str, token)
+
+    if intent_type == 'irrelevant':
+        return _text_message("Query unrelated to dataset coverage.")
+
+    if intent_type == 'simple':
+        report['mode'] = 'simple'
+        simple_json, reused = run_simple_flow(client, query, workspace, history_str, report, step, token, snippet_payload, prior)
+        if report.get('snippet_failed') and snippet is not None:
+            library.discard(snippet)
+        if 'data' not in report:
+            return _text_message("No data found.")
+        # 只要代码用到 prev_results (包括 derived_from 识别不出的动态取键)，离开该会话就不成立，不入库
+        if library is not None and not reused and not followup and 'prev_results' not in simple_json.get('code', ''):
+            library.add(query_fp, 'simple', simple_json, schema_key=data_schema)
+    else:
+        report['mode'] = 'analysis'
+        plan_json, reused, all_ok = run_analysis_flow(client, query, workspace, history_str, report, step, token, snippet_payload, prior)
+        if report.get('snippet_failed') and snippet is not None:
+            library.discard(snippet)
+        if plan_json is None or 'angles' not in plan_json:
+            return _text_message("⚠️ PLAN GENERATION FAILED")
+        if library is not None:
+            uses_prior = any('prev_results' in a.get('code', '') for a in plan_json['angles'])
+            if not reused and not followup and all_ok and report.get('insight') and not uses_prior:
+                library.add(query_fp, 'analysis', plan_json, schema_key=data_schema)
+
+    step("✅ COMPLETE")
+    return {"role": "assistant", "type": "report_block", "content": report}
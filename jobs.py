@@ -0,0 +1,348 @@
+import os
+import time
+import uuid
+import threading
+import multiprocessing as mp
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+
+import pandas as pd
+
+# -----------------------------------------------------------------------------
+# 后台任务: 取消令牌 + 可中断的 LLM 调用 + 可 kill 的代码执行
+#   Streamlit 脚本只负责提交任务和轮询进度；ABORT 直接取消令牌，
+#   排队 / 退避中的 LLM 请求立即放弃，正在 exec 的子进程被 kill。
+# -----------------------------------------------------------------------------
+
+POLL_INTERVAL_S = 0.1
+EXEC_TIMEOUT_S = 120
+JOB_TTL_S = 600               # 已结束但无人认领的任务保留时间
+ISOLATE_EXEC = hasattr(os, "fork")  # 仅在支持 fork 的平台把 exec 放到子进程
+EXEC_WORKERS = int(os.environ.get("EXEC_WORKERS", 4))
+EXEC_MAX_TASKS = 50           # 常驻执行进程跑满后换新，生成代码留下的全局状态不会一直累积
+EXEC_MAX_BASES = 2            # 同时保留的基础上下文份数 (当前 + 上一个数据集版本)
+
+_llm_pool = ThreadPoolExecutor(max_workers=16, thread_name_prefix="llm")
+_exec_bases = {}              # id(base) -> base；fork 前登记，执行进程直接从内存继承，不经 pickle
+
+
+class JobCancelled(Exception):
+    pass
+
+
+class CancelToken:
+    def __init__(self):
+        self._event = threading.Event()
+        self._lock = threading.Lock()
+        self._procs = set()
+
+    @property
+    def cancelled(self):
+        return self._event.is_set()
+
+    def cancel(self):
+        self._event.set()
+        with self._lock:
+            procs = list(self._procs)
+        for p in procs:
+            _kill(p)
+
+    def check(self):
+        if self._event.is_set():
+            raise JobCancelled()
+
+    def wait(self, seconds):
+        # 可被取消打断的 sleep
+        if self._event.wait(seconds):
+            raise JobCancelled()
+
+    def register(self, proc):
+        with self._lock:
+            self._procs.add(proc)
+        if self.cancelled:
+            _kill(proc)
+
+    def unregister(self, proc):
+        with self._lock:
+            self._procs.discard(proc)
+
+
+def _kill(proc):
+    try:
+        if proc.is_alive():
+            proc.kill()
+    except Exception:
+        pass
+
+
+def call_cancellable(fn, token=None):
+    """在线程池里跑阻塞调用，等待期间轮询令牌；取消后立即返回 (结果被丢弃)。"""
+    if token is None:
+        return fn()
+    token.check()
+
+    def guarded():
+        # 排队期间已取消则不再发出请求 (不用 future.cancel，保证 fn 内的 finally 总能执行)
+        token.check()
+        return fn()
+
+    future = _llm_pool.submit(guarded)
+    while True:
+        try:
+            return future.result(timeout=POLL_INTERVAL_S)
+        except FutureTimeout:
+            if future.done(): raise
+        if token.cancelled:
+            raise JobCancelled()
+
+
+def collect_outputs(namespace):
+    """exec 命名空间里只取结果相关的变量 (模块 / 函数不可跨进程传递)。"""
+    fallback = None
+    for k, v in namespace.items():
+        if isinstance(v, pd.DataFrame) and k != 'df':
+            fallback = v; break
+    return {"results": namespace.get('results'), "result": namespace.get('result'), "fallback_frame": fallback}
+
+
+def _to_picklable(outputs):
+    # 兜底: 规整后仍含不可 pickle 对象 (图表 / 生成器等) 时，object 列与非表格值转成字符串
+    def fix(v):
+        if isinstance(v, pd.DataFrame):
+            v = v.copy()
+            obj = v.select_dtypes(include="object").columns
+            v[obj] = v[obj].astype(str)
+            return v
+        return v if v is None else str(v)
+    results = outputs.get("results")
+    return {
+        "results": {k: fix(v) for k, v in results.items()} if isinstance(results, dict) else fix(results),
+        "result": fix(outputs.get("result")), "fallback_frame": fix(outputs.get("fallback_frame")),
+    }
+
+
+def _fresh_context(base, extra):
+    # 基础上下文里的表给浅拷贝 (写时复制)，生成代码增删列不会留到下一次执行
+    ctx = {k: v.copy(deep=False) if isinstance(v, pd.DataFrame) else v for k, v in base.items()}
+    ctx.update(extra or {})
+    return ctx
+
+
+def _exec_one(code, context, conn, postprocess=None):
+    try:
+        exec(code, context)
+        outputs = collect_outputs(context)
+        # 结果在子进程内规整好再回传，任意对象都不会因无法 pickle 让整条问题失败
+        if postprocess is not None: outputs = postprocess(outputs)
+        try:
+            conn.send(("ok", outputs))
+        except Exception:
+            conn.send(("ok", _to_picklable(outputs)))
+    except BaseException as e:
+        try: conn.send(("error", e))
+        except Exception: conn.send(("error", RuntimeError(str(e))))
+
+
+def _exec_worker(conn):
+    # 常驻执行进程: 单线程循环，基础上下文 fork 时已从父进程内存继承，每次只收代码和少量附加变量
+    while True:
+        try:
+            base_id, code, extra, postprocess = conn.recv()
+        except EOFError:
+            return
+        base = _exec_bases.get(base_id)
+        if base is None:
+            conn.send(("error", RuntimeError("execution context not available in worker")))
+            continue
+        _exec_one(code, _fresh_context(base, extra), conn, postprocess)
+
+
+class _Worker:
+    __slots__ = ("proc", "conn", "bases", "tasks")
+
+    def __init__(self, proc, conn, bases):
+        self.proc = proc
+        self.conn = conn
+        self.bases = bases
+        self.tasks = 0
+
+
+class ExecPool:
+    """预先 fork 的常驻执行进程池。多线程的 Streamlit 进程不再每段代码 fork 一次，
+    只在补员、数据集换版本、进程被 kill (取消 / 超时) 或执行满 EXEC_MAX_TASKS 次后才 fork。"""
+
+    def __init__(self, size=EXEC_WORKERS):
+        self.size = size
+        self._cond = threading.Condition()
+        self._idle = []
+        self._live = 0
+
+    def _retire(self, w):
+        _kill(w.proc)
+        w.proc.join(timeout=1)
+        w.conn.close()
+        self._live -= 1
+
+    def acquire(self, base, token):
+        base_id = id(base)
+        with self._cond:
+            if base_id not in _exec_bases:
+                # 只保留最近几份基础上下文，旧数据集版本随之释放
+                _exec_bases[base_id] = base
+                while len(_exec_bases) > EXEC_MAX_BASES:
+                    _exec_bases.pop(next(iter(_exec_bases)))
+            while True:
+                token.check()
+                for w in self._idle:
+                    if base_id in w.bases and w.proc.is_alive():
+                        self._idle.remove(w)
+                        return w
+                if self._live < self.size:
+                    self._live += 1
+                    bases = frozenset(_exec_bases)
+                    break
+                if self._idle:
+                    # 空闲进程里没有这份上下文 (fork 早于登记)，换一个新的
+                    self._retire(self._idle.pop(0))
+                    continue
+                self._cond.wait(POLL_INTERVAL_S)
+        try:
+            ctx = mp.get_context("fork")
+            parent_conn, child_conn = ctx.Pipe()
+            proc = ctx.Process(target=_exec_worker, args=(child_conn,), daemon=True)
+            proc.start()
+            child_conn.close()
+            return _Worker(proc, parent_conn, bases)
+        except BaseException:
+            with self._cond:
+                self._live -= 1
+                self._cond.notify()
+            raise
+
+    def release(self, w, healthy):
+        with self._cond:
+            w.tasks += 1
+            if healthy and w.tasks < EXEC_MAX_TASKS and w.proc.is_alive():
+                self._idle.append(w)
+            else:
+                self._retire(w)
+            self._cond.notify()
+
+
+EXEC_POOL = ExecPool()
+
+
+def run_code(code, base, extra=None, token=None, timeout=EXEC_TIMEOUT_S, postprocess=None):
+    """执行生成代码，返回 collect_outputs 的结果 (经 postprocess 规整)。
+    base: 同一数据集版本共用的基础上下文 (df / 预制函数，需保持同一对象)；extra: 每次执行的附加变量 (需可 pickle)。
+    带令牌时在常驻执行进程里跑，取消 / 超时直接 kill 该进程。"""
+    if not ISOLATE_EXEC or token is None:
+        context = _fresh_context(base, extra)
+        exec(code, context)
+        outputs = collect_outputs(context)
+        return outputs if postprocess is None else postprocess(outputs)
+
+    w = EXEC_POOL.acquire(base, token)
+    healthy = False
+    token.register(w.proc)
+    started = time.monotonic()
+    try:
+        w.conn.send((id(base), code, extra or {}, postprocess))
+        while True:
+            if w.conn.poll(POLL_INTERVAL_S):
+                try:
+                    status, payload = w.conn.recv()
+                except EOFError:
+                    token.check()
+                    raise RuntimeError("code execution process exited unexpectedly")
+                healthy = True
+                if status == "error":
+                    raise payload
+                return payload
+            token.check()
+            if not w.proc.is_alive():
+                token.check()
+                raise RuntimeError(f"code execution process exited (code {w.proc.exitcode})")
+            if time.monotonic() - started > timeout:
+                raise TimeoutError(f"code execution exceeded {timeout}s")
+    finally:
+        token.unregister(w.proc)
+        EXEC_POOL.release(w, healthy)
+
+
+class Job:
+    def __init__(self, job_id):
+        self.id = job_id
+        self.token = CancelToken()
+        self.status = "running"    # running / done / failed / cancelled
+        self.stage = ""
+        self.partial = {}
+        self.message = None
+        self.error = None
+        self.started = time.time()
+        self.finished_at = None
+        self._lock = threading.Lock()
+
+    @property
+    def finished(self):
+        return self.status != "running"
+
+    def progress(self, stage, report):
+        # 快照拷贝一层，UI 线程读取时不受后台追加影响
+        snap = dict(report)
+        for k, v in snap.items():
+            if isinstance(v, list): snap[k] = list(v)
+        with self._lock:
+            self.stage = stage
+            self.partial = snap
+
+    def snapshot(self):
+        with self._lock:
+            return self.stage, self.partial
+
+
+class JobManager:
+    def __init__(self):
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def submit(self, fn, *args, **kwargs):
+        """fn 需接受 token= / progress= 关键字参数，返回值存入 job.message。"""
+        self._prune()
+        job = Job(uuid.uuid4().hex[:12])
+        with self._lock:
+            self._jobs[job.id] = job
+
+        def runner():
+            try:
+                job.message = fn(*args, token=job.token, progress=job.progress, **kwargs)
+                job.status = "cancelled" if job.token.cancelled else "done"
+            except JobCancelled:
+                job.status = "cancelled"
+            except Exception as e:
+                job.error = e
+                job.status = "failed"
+            finally:
+                job.finished_at = time.time()
+
+        threading.Thread(target=runner, name=f"job-{job.id}", daemon=True).start()
+        return job
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def cancel(self, job_id):
+        job = self.get(job_id)
+        if job is not None:
+            job.token.cancel()
+        return job
+
+    def forget(self, job_id):
+        with self._lock:
+            self._jobs.pop(job_id, None)
+
+    def _prune(self):
+        now = time.time()
+        with self._lock:
+            for jid in [j.id for j in self._jobs.values() if j.finished_at and now - j.finished_at > JOB_TTL_S]:
+                self._jobs.pop(jid, None)
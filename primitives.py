@@ -0,0 +1,166 @@
+import numpy as np
+import pandas as pd
+
+# -----------------------------------------------------------------------------
+# 分析原语: 基于已识别的时间结构，一次分组聚合算出 MAT/YTD 合计、同比、份额、增长贡献、CAGR
+#   注入 execution_context，生成代码直接调用，避免每个回答各写一遍多次扫描 / 逐行 apply 的 pandas
+# -----------------------------------------------------------------------------
+
+VALUE_KEYWORDS = ['Sales', 'Value', '金额', '额', 'Amount', 'Qty', '量']
+CUR, PRIOR = "CUR", "PY"
+
+PRIMITIVES_PROMPT = """Prebuilt helpers (vectorized, one grouped pass). `by` = col or list; `value` defaults to main sales col;
+`window` = 'MAT' | 'YTD'; `data` = optional row subset of df (e.g. df[df['省份']=='海南']), defaults to full df.
+Only `by` is positional; pass everything else by keyword (e.g. yoy('省份', value='Sales_Value', window='YTD')):
+- mat_sum(by=None, *, value=None, window='MAT', data=None) -> current-window total (scalar if by is None)
+- ytd_sum(by=None, *, value=None, data=None) -> same as mat_sum(..., window='YTD'); takes no `window`
+- yoy(by, *, value=None, window='MAT', data=None) -> [by, <value>_<window>, <value>_<window>_PY, YoY]
+- share(by, *, within=None, value=None, window='MAT', data=None) -> [.., <value>_<window>, Share, Share_PY, Share_Chg]; `within` = parent col(s) for share inside group
+- growth_contribution(by, *, value=None, window='MAT', data=None) -> [.., <value>_<window>, <value>_<window>_PY, Delta, YoY, GrowthContrib_Pct]
+- cagr(by=None, *, value=None, data=None) -> annual totals per full year + CAGR
+- trend(by=None, *, value=None, data=None) -> periods as columns
+Prefer these over hand-written MAT/YTD/YoY/share logic."""
+
+
+def _as_list(by):
+    if by is None: return []
+    return [by] if isinstance(by, str) else list(by)
+
+
+def _default_value(df):
+    num_cols = [c for c in df.columns if pd.api.types.is_numeric_dtype(df[c])]
+    for col in num_cols:
+        if any(k in str(col) for k in VALUE_KEYWORDS):
+            return col
+    return num_cols[0] if num_cols else None
+
+
+def build_primitives(df, time_context):
+    """返回 {name: function}；时间列的字符串化和窗口映射只做一次，之后每次调用都是单次 groupby。"""
+    time_col = time_context.get('col_name')
+    default_value = _default_value(df)
+    period_key = df[time_col].astype(str) if time_col else None
+    windows = {
+        'MAT': (time_context.get('mat_list') or [], time_context.get('mat_list_prior') or []),
+        'YTD': (time_context.get('ytd_list') or [], time_context.get('ytd_list_prior') or []),
+    }
+    flags, years = {}, {}
+
+    def _period(data):
+        # 全量用缓存的字符串化时间列；传入 data 时直接从 data 自身的时间列计算，不依赖索引与 df 对齐
+        if data is None:
+            return period_key
+        if time_col not in data.columns:
+            raise ValueError(f"data must keep the time column '{time_col}'")
+        return data[time_col].astype(str)
+
+    def _flag(window, data=None):
+        # 每行属于当期 / 上年同期 / 其他，全量按窗口缓存成 Categorical
+        window = str(window).upper()
+        if window not in windows:
+            raise ValueError(f"window must be one of {list(windows)}")
+        if period_key is None:
+            raise ValueError("No time column detected in dataset")
+        cur, prior = windows[window]
+        mapping = {**{p: CUR for p in cur}, **{p: PRIOR for p in prior}}
+        if data is not None:
+            return window, pd.Series(pd.Categorical(_period(data).map(mapping), categories=[CUR, PRIOR]), index=data.index, name="_w")
+        if window not in flags:
+            flags[window] = pd.Series(pd.Categorical(period_key.map(mapping), categories=[CUR, PRIOR]), index=df.index, name="_w")
+        return window, flags[window]
+
+    def _window_pivot(by, value, window, data=None):
+        by = _as_list(by)
+        value = value or default_value
+        window, flag = _flag(window, data)
+        src = df if data is None else data
+        keys = [src[c] for c in by] + [flag]
+        # 一次 groupby 同时得到当期与上年同期
+        g = src[value].groupby(keys, observed=True, sort=False).sum()
+        wide = (g.unstack("_w") if by else g.to_frame().T).rename_axis(None, axis=1)
+        for c in (CUR, PRIOR):
+            if c not in wide.columns: wide[c] = 0.0
+        wide = wide[[CUR, PRIOR]].fillna(0)
+        return by, value, window, wide
+
+    def mat_sum(by=None, *, value=None, window='MAT', data=None):
+        by, value, window, wide = _window_pivot(by, value, window, data)
+        if not by:
+            return float(wide[CUR].iloc[0]) if len(wide) else 0.0
+        return wide[CUR].rename(f"{value}_{window}").sort_values(ascending=False).reset_index()
+
+    def ytd_sum(by=None, *, value=None, data=None):
+        return mat_sum(by, value=value, window='YTD', data=data)
+
+    def yoy(by, *, value=None, window='MAT', data=None):
+        by, value, window, wide = _window_pivot(by, value, window, data)
+        cur, py = f"{value}_{window}", f"{value}_{window}_PY"
+        out = wide.rename(columns={CUR: cur, PRIOR: py})
+        out["YoY"] = np.where(out[py] != 0, out[cur] / out[py].where(out[py] != 0) - 1, np.nan)
+        return out.sort_values(cur, ascending=False).reset_index() if by else out.reset_index(drop=True)
+
+    def share(by, *, within=None, value=None, window='MAT', data=None):
+        within = _as_list(within)
+        by_all = within + [c for c in _as_list(by) if c not in within]
+        by_all, value, window, wide = _window_pivot(by_all, value, window, data)
+        cur = f"{value}_{window}"
+        if within:
+            totals = wide.groupby(level=within, observed=True, sort=False).transform("sum")
+        else:
+            totals = wide.sum()
+        shares = wide / totals.replace(0, np.nan)
+        out = pd.DataFrame({cur: wide[CUR], "Share": shares[CUR], "Share_PY": shares[PRIOR]})
+        out["Share_Chg"] = out["Share"] - out["Share_PY"]
+        if within:
+            out = out.sort_values(within + [cur], ascending=[True] * len(within) + [False])
+        else:
+            out = out.sort_values(cur, ascending=False)
+        return out.reset_index()
+
+    def growth_contribution(by, *, value=None, window='MAT', data=None):
+        by, value, window, wide = _window_pivot(by, value, window, data)
+        cur, py = f"{value}_{window}", f"{value}_{window}_PY"
+        total_py = wide[PRIOR].sum()
+        out = wide.rename(columns={CUR: cur, PRIOR: py})
+        out["Delta"] = out[cur] - out[py]
+        out["YoY"] = out["Delta"] / out[py].where(out[py] != 0)
+        out["GrowthContrib_Pct"] = out["Delta"] / total_py if total_py else np.nan
+        return out.sort_values("Delta", ascending=False).reset_index()
+
+    def cagr(by=None, *, value=None, data=None):
+        if period_key is None:
+            raise ValueError("No time column detected in dataset")
+        by = _as_list(by)
+        value = value or default_value
+        if 'year' not in years:
+            years['year'] = period_key.str.extract(r"(\d{4})", expand=False)
+            # 完整年度按全量数据判定 (4 个季度，或非季度口径的全部年份)，避免末年 YTD 拉低 CAGR
+            quarters = period_key.groupby(years['year']).nunique()
+            is_quarterly = period_key.str.contains("Q", regex=False).any()
+            years['full'] = sorted(quarters[quarters >= 4].index if is_quarterly else quarters.index)
+        full_years = years['full']
+        if len(full_years) < 2:
+            raise ValueError("CAGR needs at least 2 full years")
+        src, year = (df, years['year']) if data is None else (data, _period(data).str.extract(r"(\d{4})", expand=False))
+        mask = year.isin(full_years)
+        g = src.loc[mask, value].groupby([src.loc[mask, c] for c in by] + [year[mask].rename("Year")], observed=True, sort=False).sum()
+        wide = (g.unstack("Year") if by else g.to_frame().T).rename_axis(None, axis=1)
+        wide = wide.reindex(columns=full_years).fillna(0)
+        first, last, n = wide[full_years[0]], wide[full_years[-1]], len(full_years) - 1
+        wide["CAGR"] = np.where(first > 0, (last / first.where(first > 0)) ** (1 / n) - 1, np.nan)
+        return wide.reset_index() if by else wide.reset_index(drop=True)
+
+    def trend(by=None, *, value=None, data=None):
+        if period_key is None:
+            raise ValueError("No time column detected in dataset")
+        by = _as_list(by)
+        value = value or default_value
+        src = df if data is None else data
+        g = src[value].groupby([src[c] for c in by] + [_period(data).rename(time_col)], observed=True, sort=False).sum()
+        wide = (g.unstack(time_col) if by else g.to_frame().T).rename_axis(None, axis=1)
+        return wide.reindex(columns=sorted(wide.columns)).fillna(0).reset_index(drop=not by)
+
+    return {
+        'mat_sum': mat_sum, 'ytd_sum': ytd_sum, 'yoy': yoy, 'share': share,
+        'growth_contribution': growth_contribution, 'cagr': cagr, 'trend': trend,
+    }
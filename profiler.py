@@ -0,0 +1,168 @@
+import re
+
+import numpy as np
+import pandas as pd
+
+# -----------------------------------------------------------------------------
+# 结果画像: 把任意结果表压缩成按字符预算截断的统计摘要，替代 head(20).to_string()
+#   全部基于列向量运算，成本只与行数线性相关；输出长度由预算封顶，与结果规模无关
+# -----------------------------------------------------------------------------
+
+DEFAULT_BUDGET = 1500      # 约 500~700 token
+TOP_K = 5
+MAX_NUMERIC_COLS = 6
+MAX_COL_LIST = 12
+SAMPLE_ROWS = 8
+PERIOD_RE = re.compile(r"^\d{4}(Q[1-4]|[-/]?\d{1,2})?$|^(MAT|YTD)", re.I)
+VALUE_KEYWORDS = ['Sales', 'Value', 'Amount', '额', '金额', 'Qty', '量']
+RATIO_KEYWORDS = ['Rate', 'Ratio', 'Share', 'Pct', 'YoY', 'CAGR', 'Growth', '率', '比', '占比', '份额', '增长']
+
+
+def fmt_num(x):
+    if x is None or (isinstance(x, float) and not np.isfinite(x)):
+        return "-"
+    ax = abs(x)
+    if ax >= 1e8: return f"{x / 1e8:.2f}亿"
+    if ax >= 1e4: return f"{x / 1e4:.2f}万"
+    if ax >= 100 or float(x).is_integer(): return f"{x:,.0f}"
+    if ax >= 1: return f"{x:.2f}"
+    return f"{x:.3g}"
+
+
+def _is_ratio(col):
+    return any(k.lower() in str(col).lower() for k in RATIO_KEYWORDS)
+
+
+def _pick_label(df):
+    for col in df.columns:
+        if not pd.api.types.is_numeric_dtype(df[col]):
+            return col
+    return None
+
+
+def _pick_measure(num_cols):
+    # 优先绝对量 (销售额 / 数量)，其次任意非比率列
+    for col in num_cols:
+        if any(k.lower() in str(col).lower() for k in VALUE_KEYWORDS) and not _is_ratio(col):
+            return col
+    for col in num_cols:
+        if not _is_ratio(col):
+            return col
+    return num_cols[0] if num_cols else None
+
+
+def _is_period_like(values):
+    sample = pd.Series(values).dropna().astype(str).head(20)
+    return len(sample) > 0 and sample.str.match(PERIOD_RE).mean() > 0.8
+
+
+def _flat_columns(columns):
+    # 多级列 (groupby().agg 多函数 / 多值 pivot_table) 拼成单层字符串，重名列加序号
+    names = ["_".join(str(p) for p in c if str(p) != "") if isinstance(c, tuple) else str(c) for c in columns]
+    seen, out = {}, []
+    for n in names:
+        seen[n] = seen.get(n, 0) + 1
+        out.append(n if seen[n] == 1 else f"{n}_{seen[n]}")
+    return out
+
+
+def profile_frame(df, budget=DEFAULT_BUDGET, top_k=TOP_K):
+    """返回紧凑文本摘要；分段按优先级拼接，超出 budget 的低优先级段落直接丢弃。"""
+    if not isinstance(df, pd.DataFrame):
+        df = pd.DataFrame(df)
+    if df.empty:
+        return "EMPTY RESULT (0 rows)"
+    if any(n is not None for n in df.index.names):
+        df = df.reset_index()
+    df = df.set_axis(_flat_columns(df.columns), axis=1)
+
+    num = df.select_dtypes(include="number")
+    num_cols = list(num.columns)
+    label = _pick_label(df)
+    measure = _pick_measure(num_cols)
+    sections = []
+
+    cols = list(df.columns)
+    col_list = ", ".join(cols[:MAX_COL_LIST]) + (f", …(+{len(cols) - MAX_COL_LIST})" if len(cols) > MAX_COL_LIST else "")
+    sections.append(f"SHAPE {len(df)}x{len(cols)} | COLS: {col_list}")
+
+    # 1. 每个数值列: 合计 / 分布 (一次 describe 向量化完成)
+    if num_cols:
+        use = num_cols[:MAX_NUMERIC_COLS]
+        desc = num[use].describe(percentiles=[.5]).T
+        sums = num[use].sum()
+        lines = []
+        for col in use:
+            d = desc.loc[col]
+            head = f"mean {fmt_num(d['mean'])}" if _is_ratio(col) else f"total {fmt_num(sums[col])}"
+            lines.append(f"- {col}: {head}, min {fmt_num(d['min'])}, p50 {fmt_num(d['50%'])}, max {fmt_num(d['max'])}, std {fmt_num(d['std'])}")
+        if len(num_cols) > MAX_NUMERIC_COLS:
+            lines.append(f"- …{len(num_cols) - MAX_NUMERIC_COLS} more numeric cols")
+        sections.append("STATS\n" + "\n".join(lines))
+
+    # 2. Top / Bottom-k 与集中度 (按主度量)
+    if label is not None and measure is not None:
+        s = num[measure].groupby(df[label].astype(str), sort=False).sum()
+        total = s.sum()
+        order = s.sort_values(ascending=False)
+        share = order / total if total else order * np.nan
+
+        def _items(part):
+            return "; ".join(
+                f"{k} {fmt_num(v)}" + (f" ({share[k]:.1%})" if total and not _is_ratio(measure) else "")
+                for k, v in part.items()
+            )
+
+        sections.append(f"TOP{min(top_k, len(order))} by {measure}: {_items(order.head(top_k))}")
+        if len(order) > top_k:
+            sections.append(f"BOTTOM{top_k} by {measure}: {_items(order.tail(top_k).iloc[::-1])}")
+        if total and not _is_ratio(measure) and len(order) > 1 and (order >= 0).all():
+            hhi = float((share ** 2).sum() * 10000)
+            sections.append(
+                f"CONCENTRATION {label}: n={len(order)}, top1 {share.iloc[0]:.1%}, "
+                f"top3 {share.head(3).sum():.1%}, top5 {share.head(5).sum():.1%}, HHI {hhi:,.0f}"
+            )
+
+    # 3. 环比 / 同比: 时间列 (长表) 或时间列名 (宽表)
+    period_lines = []
+    time_col = next((c for c in df.columns if c not in num_cols and _is_period_like(df[c].unique())), None)
+    if time_col is not None and measure is not None:
+        by_p = num[num_cols[:MAX_NUMERIC_COLS]].groupby(df[time_col].astype(str)).sum().sort_index()
+        if len(by_p) >= 2:
+            last, prev = by_p.iloc[-1], by_p.iloc[-2]
+            for col in by_p.columns:
+                if _is_ratio(col): continue
+                pct = (last[col] / prev[col] - 1) if prev[col] else np.nan
+                period_lines.append(f"- {col}: {by_p.index[-2]}→{by_p.index[-1]} {fmt_num(prev[col])}→{fmt_num(last[col])} ({pct:+.1%})")
+    else:
+        period_cols = [c for c in num_cols if PERIOD_RE.match(c)]
+        if len(period_cols) >= 2:
+            totals = num[period_cols].sum()
+            for a, b in zip(period_cols[:-1], period_cols[1:]):
+                pct = (totals[b] / totals[a] - 1) if totals[a] else np.nan
+                period_lines.append(f"- {a}→{b}: {fmt_num(totals[a])}→{fmt_num(totals[b])} ({pct:+.1%})")
+    if period_lines:
+        sections.append("PERIOD DELTA\n" + "\n".join(period_lines[:MAX_NUMERIC_COLS]))
+
+    # 4. 比率列的极值行 (增长率 / 份额类结果最关心谁最高最低)
+    if label is not None:
+        ratio_lines = []
+        for col in [c for c in num_cols if _is_ratio(c)][:3]:
+            vals = num[col].to_numpy(dtype=float)
+            if np.isfinite(vals).any():
+                hi, lo = np.nanargmax(vals), np.nanargmin(vals)
+                ratio_lines.append(f"- {col}: max {df[label].iloc[hi]} {fmt_num(vals[hi])}, min {df[label].iloc[lo]} {fmt_num(vals[lo])}")
+        if ratio_lines:
+            sections.append("RATIO EXTREMES\n" + "\n".join(ratio_lines))
+
+    # 5. 少量样例行 (CSV 比 to_string 的对齐填充省得多)，预算剩余时才带上
+    sections.append("SAMPLE (csv)\n" + df.head(SAMPLE_ROWS).to_csv(index=False, float_format="%.4g").strip())
+
+    out, used = [], 0
+    for sec in sections:
+        if used + len(sec) + 1 > budget:
+            if not out:
+                out.append(sec[:budget])
+            continue
+        out.append(sec); used += len(sec) + 1
+    return "\n".join(out)
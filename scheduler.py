@@ -0,0 +1,196 @@
+import os
+import time
+import threading
+import contextvars
+from collections import deque, defaultdict
+from contextlib import contextmanager
+
+from jobs import JobCancelled
+
+# -----------------------------------------------------------------------------
+# GenAI 请求调度: 进程级准入控制 + 会话间公平排队 + 交互优先
+#   所有会话共享一个 client，这里统一卡住并发数和每分钟请求数 (留余量不碰限流线)，
+#   同优先级内按会话轮转出队，避免一个 5 角度报告把其他人饿死。
+# -----------------------------------------------------------------------------
+
+MAX_CONCURRENCY = int(os.environ.get("GENAI_MAX_CONCURRENCY", 4))
+RPM_LIMIT = int(os.environ.get("GENAI_RPM_LIMIT", 60))
+RPM_HEADROOM = 0.85          # 实际只用到配额的 85%
+WINDOW_S = 60.0
+WAIT_POLL_S = 0.1
+
+PRIORITY_INTERACTIVE = 0     # router / codegen / plan: 用户在等
+PRIORITY_BACKGROUND = 1      # 角度解读 / 汇总: 仍是用户正在等的报告
+PRIORITY_PRECOMPUTE = 2      # 预计算: 只在没有任何实时请求排队时放行
+PRIORITY_NAMES = {PRIORITY_INTERACTIVE: "interactive", PRIORITY_BACKGROUND: "background", PRIORITY_PRECOMPUTE: "precompute"}
+
+_current_session = contextvars.ContextVar("genai_session", default="anonymous")
+_priority_floor = contextvars.ContextVar("genai_priority_floor", default=PRIORITY_INTERACTIVE)
+
+
+class _Waiter:
+    __slots__ = ("session", "priority", "enqueued", "granted")
+
+    def __init__(self, session, priority):
+        self.session = session
+        self.priority = priority
+        self.enqueued = time.monotonic()
+        self.granted = False
+
+
+class RequestScheduler:
+    def __init__(self, max_concurrency=MAX_CONCURRENCY, rpm_limit=RPM_LIMIT, headroom=RPM_HEADROOM):
+        self.max_concurrency = max_concurrency
+        self.rpm_cap = max(1, int(rpm_limit * headroom))
+        self._cond = threading.Condition()
+        # priority -> session -> deque[_Waiter]；priority -> 会话轮转顺序
+        self._queues = defaultdict(lambda: defaultdict(deque))
+        self._rr = defaultdict(deque)
+        self._in_flight = 0
+        self._sent = deque()           # 最近 60s 的放行时间戳
+        self._paused_until = 0.0       # 收到 429 后整体暂停
+        self._stats = {"granted": 0, "cancelled": 0, "throttled": 0, "wait_total_s": 0.0, "wait_max_s": 0.0}
+
+    # --- 内部: 需持有 self._cond ---
+    def _rate_wait(self, now):
+        while self._sent and now - self._sent[0] >= WINDOW_S:
+            self._sent.popleft()
+        if now < self._paused_until:
+            return self._paused_until - now
+        if len(self._sent) >= self.rpm_cap:
+            return WINDOW_S - (now - self._sent[0])
+        return 0.0
+
+    def _next_waiter(self):
+        for priority in sorted(self._rr):
+            order = self._rr[priority]
+            for _ in range(len(order)):
+                session = order[0]
+                order.rotate(-1)
+                q = self._queues[priority][session]
+                if q:
+                    w = q.popleft()
+                    if not q:
+                        del self._queues[priority][session]
+                        order.remove(session)
+                    return w
+        return None
+
+    def _dispatch(self):
+        now = time.monotonic()
+        while self._in_flight < self.max_concurrency and self._rate_wait(now) <= 0:
+            w = self._next_waiter()
+            if w is None:
+                break
+            w.granted = True
+            self._in_flight += 1
+            self._sent.append(now)
+            waited = now - w.enqueued
+            self._stats["granted"] += 1
+            self._stats["wait_total_s"] += waited
+            self._stats["wait_max_s"] = max(self._stats["wait_max_s"], waited)
+        self._cond.notify_all()
+
+    def _remove(self, w):
+        q = self._queues[w.priority].get(w.session)
+        if q and w in q:
+            q.remove(w)
+            if not q:
+                del self._queues[w.priority][w.session]
+                self._rr[w.priority].remove(w.session)
+
+    # --- 对外接口 ---
+    def configure(self, max_concurrency=None, rpm_limit=None, headroom=RPM_HEADROOM):
+        # 批处理多进程时按进程数切分全局配额
+        with self._cond:
+            if max_concurrency is not None:
+                self.max_concurrency = max(1, max_concurrency)
+            if rpm_limit is not None:
+                self.rpm_cap = max(1, int(rpm_limit * headroom))
+            self._dispatch()
+
+    def acquire(self, session=None, priority=PRIORITY_BACKGROUND, token=None):
+        session = session or _current_session.get()
+        priority = max(priority, _priority_floor.get())
+        w = _Waiter(session, priority)
+        with self._cond:
+            if session not in self._queues[priority]:
+                self._rr[priority].append(session)
+            self._queues[priority][session].append(w)
+            while True:
+                self._dispatch()
+                if w.granted:
+                    return w
+                if token is not None and token.cancelled:
+                    self._remove(w)
+                    self._stats["cancelled"] += 1
+                    raise JobCancelled()
+                timeout = WAIT_POLL_S if token is not None else max(WAIT_POLL_S, min(1.0, self._rate_wait(time.monotonic())))
+                self._cond.wait(timeout)
+
+    def release(self, ticket):
+        with self._cond:
+            if ticket.granted:
+                ticket.granted = False
+                self._in_flight -= 1
+            self._dispatch()
+
+    @contextmanager
+    def slot(self, priority=PRIORITY_BACKGROUND, token=None, session=None):
+        ticket = self.acquire(session, priority, token)
+        try:
+            yield ticket
+        finally:
+            self.release(ticket)
+
+    def report_throttle(self, backoff_s):
+        # 上游返回 429: 全局暂停放行，而不是每个会话各自 sleep 后一起重试
+        with self._cond:
+            self._paused_until = max(self._paused_until, time.monotonic() + backoff_s)
+            self._stats["throttled"] += 1
+
+    def metrics(self):
+        with self._cond:
+            now = time.monotonic()
+            self._rate_wait(now)
+            depth = {
+                PRIORITY_NAMES.get(p, p): sum(len(q) for q in sessions.values())
+                for p, sessions in self._queues.items()
+            }
+            per_session = defaultdict(int)
+            for sessions in self._queues.values():
+                for s, q in sessions.items():
+                    per_session[s] += len(q)
+            granted = self._stats["granted"]
+            return {
+                "in_flight": self._in_flight, "max_concurrency": self.max_concurrency,
+                "queued": sum(depth.values()), "queue_depth": depth, "queue_by_session": dict(per_session),
+                "rpm_used": len(self._sent), "rpm_cap": self.rpm_cap,
+                "paused_s": round(max(0.0, self._paused_until - now), 1),
+                "avg_wait_s": round(self._stats["wait_total_s"] / granted, 3) if granted else 0.0,
+                "max_wait_s": round(self._stats["wait_max_s"], 3),
+                "granted": granted, "cancelled": self._stats["cancelled"], "throttled": self._stats["throttled"],
+            }
+
+
+SCHEDULER = RequestScheduler()
+
+
+@contextmanager
+def session_scope(session_id):
+    """在当前线程 (后台任务) 内标记请求归属的会话，供公平排队使用。"""
+    reset = _current_session.set(session_id or "anonymous")
+    try:
+        yield
+    finally:
+        _current_session.reset(reset)
+
+
+@contextmanager
+def priority_scope(priority):
+    """当前线程内的请求优先级不高于 priority (预计算任务整体降级，不和用户的实时请求抢槽位)。"""
+    reset = _priority_floor.set(priority)
+    try:
+        yield
+    finally:
+        _priority_floor.reset(reset)
@@ -0,0 +1,222 @@
+import os
+import re
+import hashlib
+import json
+import time
+import threading
+import unicodedata
+
+# -----------------------------------------------------------------------------
+# 查询 → 代码 复用库
+#   query 归一化为指纹: 数据集取值 (经 ValueIndex 解析，含别名 / 拼音) → <列名> 槽位，时间词 → <MAT>/<YTD>，数字 → <N>
+#   只在指纹完全一致时复用 (做参数替换后直接执行，跳过 LLM 生成)；
+#   字面相似度不可靠: "最高 / 最低"、"包含 / 排除" 只差一两个字，语义却相反
+# -----------------------------------------------------------------------------
+
+LIBRARY_FILE = os.path.join(".cache", "snippets.json")
+MAX_ENTRIES = 500
+
+TIME_ALIASES = {
+    "<MAT>": ["mat", "rolling 12", "rolling year", "last 12 months", "trailing 12", "滚动年", "滚动12个月", "近12个月", "近一年"],
+    "<YTD>": ["ytd", "year to date", "year-to-date", "this year", "年初至今", "今年以来", "今年"],
+}
+
+# 依赖上下文的追问不适合复用 (交给 LLM 结合历史处理)
+FOLLOWUP_MARKERS = ["that", "those", "above", "previous", "same", "上面", "刚才", "上述", "这个", "那个", "它们", "再"]
+
+_TIME_PATTERNS = [
+    (tag, re.compile("|".join(re.escape(a) for a in sorted(aliases, key=len, reverse=True))))
+    for tag, aliases in TIME_ALIASES.items()
+]
+# 只用 ASCII 字母数字作边界 (\w 包含汉字，"前10名" 里的 10 会被漏掉)
+_NUM_RE = re.compile(r"(?<![a-z0-9_<])(\d+)(?![a-z0-9_>])")
+_TRAILING_PUNCT = "?？.。!！ "
+_CJK_RE = re.compile(r"[㐀-鿿]")
+
+
+def _normalize_text(text):
+    text = unicodedata.normalize("NFKC", str(text)).lower()
+    return re.sub(r"\s+", " ", text).strip()
+
+
+def _key_pattern(key):
+    # ValueIndex 的键已把标点统一成空格，这里按去空格后的字符匹配原文 ("hong kong" / "hongkong" 都能对上)
+    body = r"[\W_]*".join(re.escape(c) for c in key.replace(" ", ""))
+    return re.compile(body if _CJK_RE.search(key) else rf"(?<![a-z0-9]){body}(?![a-z0-9])")
+
+
+def fingerprint(query, index=None):
+    """返回 {text, slots: {列名: 原始取值}, nums: [..], time: [..]}；index 为工作区的 ValueIndex。"""
+    text = _normalize_text(query)
+    slots, seen = {}, set()
+    # 只取精确 / 别名 / 拼音命中，模糊命中不做槽位 (指纹必须确定)
+    for m in (index.resolve(query) if index is not None else []):
+        if m["how"] == "fuzzy" or m["key"] in seen:
+            continue
+        seen.add(m["key"])
+        if m["col"] in slots:
+            continue  # 同一列多个取值无法安全替换，保留原文
+        pat = _key_pattern(m["key"])
+        if not pat.search(text):
+            continue
+        slots[m["col"]] = m["value"]
+        text = pat.sub(f"<{m['col']}>", text)
+    time_tags = []
+    for tag, pattern in _TIME_PATTERNS:
+        if pattern.search(text):
+            time_tags.append(tag)
+            text = pattern.sub(tag, text)
+    nums = _NUM_RE.findall(text)
+    text = _NUM_RE.sub("<N>", text).rstrip(_TRAILING_PUNCT)
+    return {"text": text, "slots": slots, "nums": nums, "time": time_tags}
+
+
+def is_followup(query):
+    text = _normalize_text(query)
+    return any(re.search(rf"(?<![a-z]){re.escape(m)}(?![a-z])", text) for m in FOLLOWUP_MARKERS)
+
+
+def _literal_pattern(value):
+    return re.compile(r"""(['"])%s\1""" % re.escape(str(value)))
+
+
+def _substitute_code(code, entry, fp):
+    old_slots, new_slots = entry["slots"], fp["slots"]
+    for col, old in old_slots.items():
+        new = new_slots[col]
+        if str(old) == str(new):
+            continue
+        pat = _literal_pattern(old)
+        if not pat.search(code):
+            return None
+        code = pat.sub(lambda m: f"{m.group(1)}{new}{m.group(1)}", code)
+    for old, new in zip(entry["nums"], fp["nums"]):
+        if old == new:
+            continue
+        pat = re.compile(rf"\b(head|tail|nlargest|nsmallest)\(\s*{old}\b")
+        if not pat.search(code):
+            return None
+        code = pat.sub(lambda m: f"{m.group(1)}({new}", code)
+    return code
+
+
+def _substitute_text(text, entry, fp):
+    # 展示文本 (意图 / 标题 / 说明) 跟随新参数: 取值与数字一次性替换，避免 5→10、10→20 这类链式替换
+    if not isinstance(text, str):
+        return text
+    mapping = {str(old): str(fp["slots"][col]) for col, old in entry["slots"].items() if str(old) != str(fp["slots"][col])}
+    if mapping:
+        pat = re.compile("|".join(re.escape(k) for k in sorted(mapping, key=len, reverse=True)))
+        text = pat.sub(lambda m: mapping[m.group(0)], text)
+    nums = {old: new for old, new in zip(entry["nums"], fp["nums"]) if old != new}
+    if nums:
+        pat = re.compile(r"(?<![0-9.])(%s)(?![0-9.])" % "|".join(re.escape(k) for k in nums))
+        text = pat.sub(lambda m: nums[m.group(1)], text)
+    return text
+
+
+def _substitute_labels(payload, entry, fp):
+    chart = payload.get("chart")
+    if isinstance(chart, dict) and "title" in chart:
+        chart["title"] = _substitute_text(chart["title"], entry, fp)
+
+
+class SnippetLibrary:
+    def __init__(self, path=LIBRARY_FILE, read_only=False):
+        # read_only: 多进程批处理时只查不写，避免并发覆盖库文件
+        self.path = path
+        self.read_only = read_only
+        self._lock = threading.Lock()
+        self._entries = []
+        self._load()
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                self._entries = json.load(f)
+        except Exception:
+            self._entries = []
+
+    def _save(self):
+        if self.read_only:
+            return
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp = self.path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self._entries, f, ensure_ascii=False, default=str)
+        os.replace(tmp, self.path)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def lookup(self, fp, schema_key=None):
+        """指纹文本 / 槽位列 / 数字个数 / 时间口径全部一致才算命中，返回 entry 或 None。"""
+        with self._lock:
+            for e in reversed(self._entries):
+                if e["text"] != fp["text"] or set(e["slots"]) != set(fp["slots"]) or len(e["nums"]) != len(fp["nums"]) or e["time"] != fp["time"]:
+                    continue
+                if schema_key and e.get("schema_key") not in (None, schema_key):
+                    continue
+                return e
+        return None
+
+    def instantiate(self, entry, fp):
+        """把库里的 payload 按新参数替换后返回 (simple_json / plan_json)；无法安全替换返回 None。"""
+        payload = json.loads(json.dumps(entry["payload"], ensure_ascii=False))
+        if entry["mode"] == "simple":
+            code = _substitute_code(payload.get("code", ""), entry, fp)
+            if code is None:
+                return None
+            payload["code"] = code
+            if isinstance(payload.get("summary"), dict):
+                payload["summary"] = {k: _substitute_text(v, entry, fp) for k, v in payload["summary"].items()}
+            _substitute_labels(payload, entry, fp)
+        else:
+            for angle in payload.get("angles", []):
+                code = _substitute_code(angle.get("code", ""), entry, fp)
+                if code is None:
+                    return None
+                angle["code"] = code
+                for field in ("title", "description"):
+                    if field in angle: angle[field] = _substitute_text(angle[field], entry, fp)
+                _substitute_labels(angle, entry, fp)
+            if "intent_analysis" in payload:
+                payload["intent_analysis"] = _substitute_text(payload["intent_analysis"], entry, fp)
+        with self._lock:
+            entry["hits"] = entry.get("hits", 0) + 1
+            entry["last_used"] = time.time()
+            try: self._save()
+            except OSError: pass
+        return payload
+
+    def add(self, fp, mode, payload, schema_key=None):
+        if self.read_only:
+            return
+        entry = {
+            "text": fp["text"], "slots": {k: str(v) for k, v in fp["slots"].items()}, "nums": fp["nums"],
+            "time": fp["time"], "mode": mode, "payload": payload, "schema_key": schema_key,
+            "hits": 0, "created": time.time(), "last_used": time.time(),
+        }
+        with self._lock:
+            # 同一指纹只保留最新一份
+            self._entries = [e for e in self._entries if not (e["text"] == entry["text"] and e["mode"] == mode)]
+            self._entries.append(entry)
+            if len(self._entries) > MAX_ENTRIES:
+                self._entries.sort(key=lambda e: (e.get("hits", 0), e.get("last_used", 0)), reverse=True)
+                self._entries = self._entries[:MAX_ENTRIES]
+            try: self._save()
+            except OSError: pass
+
+    def discard(self, entry):
+        with self._lock:
+            self._entries = [e for e in self._entries if e is not entry]
+            try: self._save()
+            except OSError: pass
+
+
+def schema_key(df):
+    # 列名 + dtype 一致的数据集之间可以共享代码片段
+    sig = "|".join(f"{c}:{t}" for c, t in zip(df.columns, df.dtypes))
+    return hashlib.sha1(sig.encode()).hexdigest()[:16]
@@ -0,0 +1,157 @@
+import os
+import re
+import sys
+import time
+import base64
+import pickle
+import hashlib
+
+import engine
+
+# -----------------------------------------------------------------------------
+# 启动管线: 静态资源预编码 + 数据集预热快照 + 冷启动 / 重跑耗时预算
+#   部署时先执行 `python startup.py` (见 .devcontainer)，数据集 / 时间结构 / 元数据
+#   会被写入磁盘快照，第一位访客只需反序列化快照，不再付 read_excel 的代价。
+# -----------------------------------------------------------------------------
+
+SNAPSHOT_DIR = ".cache"
+SNAPSHOT_VERSION = 2  # 快照结构变化时递增，旧快照自动失效
+
+# 预算 (秒 / 毫秒)。`python startup.py` 超预算时以非零码退出，方便 CI 跟踪
+PERF_BUDGET = {
+    "cold_start_s": 3.0,       # 冷启动: 快照命中时的数据集 + 元数据就绪耗时
+    "warmup_s": 60.0,          # 部署预热: 无快照时完整加载 + 写快照
+    "rerun_overhead_ms": 50.0, # 每次 rerun 的框架开销 (CSS / Header / 侧边栏)
+}
+
+BOOT_TIMINGS = {}
+
+
+def record_timing(name, seconds):
+    BOOT_TIMINGS[name] = round(seconds, 4)
+    return seconds
+
+
+def minify_css(css):
+    css = re.sub(r"/\*.*?\*/", "", css, flags=re.S)
+    css = re.sub(r"\s+", " ", css)
+    css = re.sub(r"\s*([{};:,>])\s*", r"\1", css)
+    return css.strip()
+
+
+def encode_logo(logo_file):
+    if not os.path.exists(logo_file):
+        return ""
+    with open(logo_file, "rb") as f:
+        return base64.b64encode(f.read()).decode()
+
+
+def build_static_assets(css, logo_file):
+    """一次性生成 <style> 块与 logo 的 data URI，之后每次 rerun 直接复用字符串。"""
+    t0 = time.perf_counter()
+    style_html = f"<style>{minify_css(css)}</style>"
+    logo_b64 = encode_logo(logo_file)
+    logo_html = (
+        f'<img src="data:image/png;base64,{logo_b64}" style="height:30px; margin-right:10px;">'
+        if logo_b64 else '<span style="font-size:24px; margin-right:5px;">🧬</span>'
+    )
+    record_timing("static_assets_s", time.perf_counter() - t0)
+    return {"style_html": style_html, "logo_html": logo_html}
+
+
+def dataset_version(file_name):
+    # 文件路径 + mtime + size 足以判定数据是否刷新，无需读文件内容
+    if not os.path.exists(file_name):
+        return "demo"
+    st_ = os.stat(file_name)
+    raw = f"{os.path.abspath(file_name)}|{st_.st_mtime_ns}|{st_.st_size}|{SNAPSHOT_VERSION}"
+    return hashlib.sha1(raw.encode()).hexdigest()[:16]
+
+
+def _snapshot_path(version):
+    return os.path.join(SNAPSHOT_DIR, f"workspace_{version}.pkl")
+
+
+def read_snapshot(version):
+    path = _snapshot_path(version)
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, "rb") as f:
+            return pickle.load(f)
+    except Exception:
+        return None
+
+
+def write_snapshot(version, workspace):
+    os.makedirs(SNAPSHOT_DIR, exist_ok=True)
+    for old in os.listdir(SNAPSHOT_DIR):
+        if old.startswith("workspace_") and old != os.path.basename(_snapshot_path(version)):
+            try: os.remove(os.path.join(SNAPSHOT_DIR, old))
+            except OSError: pass
+    tmp = _snapshot_path(version) + ".tmp"
+    with open(tmp, "wb") as f:
+        pickle.dump(workspace, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp, _snapshot_path(version))
+
+
+def warm_workspace(file_name=engine.DATA_FILE, use_snapshot=True):
+    """返回 {df, time_context, meta_data, value_index, version}；优先读快照，否则完整构建并落盘。"""
+    t0 = time.perf_counter()
+    version = dataset_version(file_name)
+    workspace = read_snapshot(version) if use_snapshot and version != "demo" else None
+    source = "snapshot"
+    if workspace is None:
+        source = "build"
+        t = time.perf_counter()
+        df = engine.load_data(file_name)
+        record_timing("load_data_s", time.perf_counter() - t)
+        t = time.perf_counter()
+        time_context = engine.analyze_time_structure(df)
+        record_timing("time_structure_s", time.perf_counter() - t)
+        t = time.perf_counter()
+        meta_data = engine.build_metadata(df, time_context)
+        record_timing("metadata_s", time.perf_counter() - t)
+        t = time.perf_counter()
+        value_index = engine.ValueIndex(df)
+        record_timing("value_index_s", time.perf_counter() - t)
+        workspace = {"df": df, "time_context": time_context, "meta_data": meta_data, "value_index": value_index, "version": version}
+        if version != "demo":
+            try: write_snapshot(version, workspace)
+            except OSError: pass
+    BOOT_TIMINGS["workspace_source"] = source
+    record_timing("workspace_s", time.perf_counter() - t0)
+    return workspace
+
+
+def check_budget(timings=None):
+    """返回超预算项列表 [(name, actual, budget)]。"""
+    timings = BOOT_TIMINGS if timings is None else timings
+    over = []
+    if timings.get("workspace_source") == "snapshot" and timings.get("workspace_s", 0) > PERF_BUDGET["cold_start_s"]:
+        over.append(("cold_start_s", timings["workspace_s"], PERF_BUDGET["cold_start_s"]))
+    if timings.get("workspace_source") == "build" and timings.get("workspace_s", 0) > PERF_BUDGET["warmup_s"]:
+        over.append(("warmup_s", timings["workspace_s"], PERF_BUDGET["warmup_s"]))
+    if timings.get("rerun_overhead_ms", 0) > PERF_BUDGET["rerun_overhead_ms"]:
+        over.append(("rerun_overhead_ms", timings["rerun_overhead_ms"], PERF_BUDGET["rerun_overhead_ms"]))
+    return over
+
+
+def main(argv):
+    file_name = argv[1] if len(argv) > 1 else engine.DATA_FILE
+    warm_workspace(file_name, use_snapshot=False)   # 部署预热: 强制重建快照
+    build_timings = dict(BOOT_TIMINGS)
+    BOOT_TIMINGS.clear()
+    warm_workspace(file_name)                       # 模拟首位访客: 走快照
+    cold_timings = dict(BOOT_TIMINGS)
+
+    print(f"[warmup]     {build_timings}")
+    print(f"[cold-start] {cold_timings}")
+    over = check_budget(build_timings) + check_budget(cold_timings)
+    for name, actual, budget in over:
+        print(f"[OVER BUDGET] {name}: {actual} > {budget}")
+    return 1 if over else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
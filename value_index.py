@@ -0,0 +1,234 @@
+import os
+import re
+import json
+import difflib
+import unicodedata
+from collections import Counter, defaultdict
+
+import pandas as pd
+
+try:
+    from pypinyin import lazy_pinyin
+except ImportError:  # 可选依赖: 未安装时只用内置地名表 + 自定义别名
+    lazy_pinyin = None
+
+# -----------------------------------------------------------------------------
+# 取值倒排索引: 在本地把 query 里提到的实体解析成数据集中的真实取值
+#   归一化文本 / 去行政后缀 / 拼音与别名表 / 字符 bigram 模糊匹配，
+#   只把命中的取值注入提示词，替代 【Meta】 里整列整列的取值清单
+# -----------------------------------------------------------------------------
+
+ALIAS_FILE = "value_aliases.json"  # 可选: {"数据集取值或简称": ["别名", ...]}
+MAX_UNIQUES = 20000                # 超过该基数的列 (流水号 / 明细) 不建索引
+MIN_KEY_LEN = 2
+NGRAM = 2
+MAX_CANDIDATES = 50
+FUZZY_MIN_COVERAGE = 0.5           # bigram 覆盖率预筛
+FUZZY_MIN_RATIO = 0.8
+MAX_MATCHES = 12
+FUZZY_PER_SPAN = 3                 # 同一段文字最多给出几个并列的模糊候选
+PREFIX_MIN_LEN = 3                 # "阿莫西林" → "阿莫西林胶囊"、"lipitor 20" → "lipitor 20mg" 这类前缀命中
+PREFIX_SCORE = 0.85                # 前缀命中统一打分，同前缀的多个取值并列给出
+PINYIN_MAX_LEN = 8
+
+ADMIN_SUFFIXES = ["特别行政区", "维吾尔自治区", "壮族自治区", "回族自治区", "自治区", "省", "市", "地区"]
+
+PLACE_ALIASES = {
+    "北京": ["beijing", "peking"], "天津": ["tianjin"], "河北": ["hebei"], "山西": ["shanxi"],
+    "内蒙古": ["inner mongolia", "neimenggu"], "辽宁": ["liaoning"], "吉林": ["jilin"], "黑龙江": ["heilongjiang"],
+    "上海": ["shanghai"], "江苏": ["jiangsu"], "浙江": ["zhejiang"], "安徽": ["anhui"], "福建": ["fujian"],
+    "江西": ["jiangxi"], "山东": ["shandong"], "河南": ["henan"], "湖北": ["hubei"], "湖南": ["hunan"],
+    "广东": ["guangdong", "canton"], "广西": ["guangxi"], "海南": ["hainan"], "重庆": ["chongqing"],
+    "四川": ["sichuan"], "贵州": ["guizhou"], "云南": ["yunnan"], "西藏": ["tibet", "xizang"],
+    "陕西": ["shaanxi"], "甘肃": ["gansu"], "青海": ["qinghai"], "宁夏": ["ningxia"], "新疆": ["xinjiang"],
+    "香港": ["hong kong", "hongkong"], "澳门": ["macau", "macao"], "台湾": ["taiwan"],
+    "华东": ["east china"], "华南": ["south china"], "华北": ["north china"], "华中": ["central china"],
+    "西南": ["southwest china"], "西北": ["northwest china"], "东北": ["northeast china"],
+}
+
+_CJK_RE = re.compile(r"[㐀-鿿]")
+_SEP_RE = re.compile(r"[\W_]+")
+
+
+def normalize(text):
+    """NFKC + 小写，标点 / 下划线统一成单个空格。"""
+    text = unicodedata.normalize("NFKC", str(text)).lower()
+    return _SEP_RE.sub(" ", text).strip()
+
+
+def _compact(text):
+    return text.replace(" ", "")
+
+
+def _grams(compact):
+    return {compact[i:i + NGRAM] for i in range(len(compact) - NGRAM + 1)}
+
+
+def _strip_suffix(text):
+    for suffix in ADMIN_SUFFIXES:
+        if text.endswith(suffix) and len(text) - len(suffix) >= MIN_KEY_LEN:
+            return text[:-len(suffix)]
+    return text
+
+
+def load_aliases(path=ALIAS_FILE):
+    if not os.path.exists(path):
+        return {}
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+class ValueIndex:
+    """{归一化键 → 取值} 倒排表 + bigram → 键 的倒排表；纯 dict / list，可随工作区快照落盘。"""
+
+    def __init__(self, df, max_uniques=MAX_UNIQUES, aliases=None):
+        self.entries = []   # [(列名, 原始取值)]
+        self.keys = {}      # key -> {entry_id: how}
+        self.grams = defaultdict(set)
+        for col in df.columns:
+            s = df[col]
+            if not (pd.api.types.is_object_dtype(s) or pd.api.types.is_string_dtype(s) or isinstance(s.dtype, pd.CategoricalDtype)):
+                continue
+            uniques = s.dropna().unique()
+            if len(uniques) > max_uniques:
+                continue
+            for raw in uniques:
+                eid = len(self.entries)
+                self.entries.append((str(col), raw))
+                key = normalize(raw)
+                self._add(key, eid, "exact")
+                short = _strip_suffix(key)
+                if short != key:
+                    self._add(short, eid, "alias")
+                if lazy_pinyin is not None and _CJK_RE.search(short) and len(short) <= PINYIN_MAX_LEN:
+                    self._add("".join(lazy_pinyin(short)), eid, "pinyin")
+        table = {**PLACE_ALIASES, **(load_aliases() if aliases is None else aliases)}
+        for canonical, names in table.items():
+            targets = self.keys.get(normalize(canonical))
+            if not targets:
+                continue
+            for name in ([names] if isinstance(names, str) else names):
+                for eid in list(targets):
+                    self._add(normalize(name), eid, "alias")
+        self.grams = dict(self.grams)
+
+    def _add(self, key, eid, how):
+        if len(_compact(key)) < MIN_KEY_LEN:
+            return
+        slot = self.keys.setdefault(key, {})
+        if eid not in slot:
+            slot[eid] = how
+        for g in _grams(_compact(key)):
+            self.grams[g].add(key)
+
+    def __len__(self):
+        return len(self.entries)
+
+    @staticmethod
+    def _exact_hit(key, spaced, compact):
+        # 含中文的键按去空格子串匹配；纯拉丁键要求词边界，避免 "an" 命中 "analysis"
+        if _CJK_RE.search(key):
+            return _compact(key) in compact
+        return re.search(rf"(?<![a-z0-9]){re.escape(key)}(?![a-z0-9])", spaced) is not None
+
+    @staticmethod
+    def _fuzzy_ratio(key, spaced, compact):
+        """返回 (相似度, query 中最相近的片段)；片段用于和已命中的位置去重。"""
+        if _CJK_RE.search(key):
+            k = _compact(key)
+            windows = {compact[i:i + n] for n in range(max(MIN_KEY_LEN, len(k) - 2), len(k) + 2) for i in range(len(compact) - n + 1)}
+        else:
+            tokens = spaced.split()
+            n = len(key.split())
+            windows = {" ".join(tokens[i:i + m]) for m in {max(1, n - 1), n, n + 1} for i in range(len(tokens) - m + 1)}
+            k = key
+        best, best_w = 0.0, None
+        for w in windows:
+            if k.startswith(w) and w != k:
+                # 拉丁文单个词 (share / trend) 太常见，只是取值开头的一个词不算命中；前缀只认中文或多词片段
+                if _CJK_RE.search(w) is None and " " not in w:
+                    continue
+                if len(_compact(w)) < max(PREFIX_MIN_LEN, len(_compact(k)) / 2):
+                    continue
+                ratio = PREFIX_SCORE
+            else:
+                sm = difflib.SequenceMatcher(None, k, w)
+                if sm.real_quick_ratio() < FUZZY_MIN_RATIO or sm.quick_ratio() < FUZZY_MIN_RATIO:
+                    continue
+                ratio = sm.ratio()
+            if ratio > best:
+                best, best_w = ratio, w
+        return best, best_w
+
+    def resolve(self, query, limit=MAX_MATCHES):
+        """返回 [{col, value, key, how, score}]，精确 / 别名命中在前，模糊命中按分数排在后面。"""
+        spaced = normalize(query)
+        compact = _compact(spaced)
+        hits = Counter()
+        for g in _grams(compact):
+            for key in self.grams.get(g, ()):
+                hits[key] += 1
+
+        exact, fuzzy = [], []
+        for key, n in hits.items():
+            need = len(_grams(_compact(key)))
+            if n == need and self._exact_hit(key, spaced, compact):
+                exact.append(key)
+            elif n / need >= FUZZY_MIN_COVERAGE:
+                fuzzy.append((n / need, key))
+
+        # 较长的命中覆盖其子串 (query "江苏省" 不再额外匹配 "江苏")
+        exact.sort(key=len, reverse=True)
+        kept = []
+        for key in exact:
+            if not any(_compact(key) in _compact(k) for k in kept):
+                kept.append(key)
+
+        # 已被精确命中占用的 query 位置，模糊候选落在这些位置上就不再给出
+        covered = {}
+        for key in kept:
+            start = compact.find(_compact(key))
+            if start >= 0:
+                covered[(start, start + len(_compact(key)))] = [1.0, FUZZY_PER_SPAN]
+
+        matches, seen = [], set()
+        for key in kept:
+            for eid, how in self.keys[key].items():
+                if eid not in seen:
+                    seen.add(eid)
+                    matches.append({"col": self.entries[eid][0], "value": self.entries[eid][1], "key": key, "how": how, "score": 1.0})
+
+        scored = []
+        for _, key in sorted(fuzzy, reverse=True)[:MAX_CANDIDATES]:
+            if any(_compact(key) in _compact(k) or _compact(k) in _compact(key) for k in kept):
+                continue
+            ratio, window = self._fuzzy_ratio(key, spaced, compact)
+            if ratio >= FUZZY_MIN_RATIO:
+                scored.append((ratio, key, window))
+        for ratio, key, window in sorted(scored, reverse=True):
+            start = compact.find(_compact(window))
+            span = (start, start + len(_compact(window)))
+            slot = next((v for (a, b), v in covered.items() if min(b, span[1]) - max(a, span[0]) > (span[1] - span[0]) / 2), None)
+            if slot is None:
+                covered[span] = slot = [ratio, FUZZY_PER_SPAN]
+            if ratio < slot[0] or slot[1] <= 0:
+                continue
+            slot[1] -= 1
+            for eid in self.keys[key]:
+                if eid not in seen:
+                    seen.add(eid)
+                    matches.append({"col": self.entries[eid][0], "value": self.entries[eid][1], "key": key, "how": "fuzzy", "score": round(ratio, 2)})
+        return matches[:limit]
+
+
+def format_matches(matches):
+    if not matches:
+        return "No dataset values recognized in the query."
+    lines = []
+    for m in matches:
+        note = "" if m["how"] == "exact" else f'  ← "{m["key"]}" ({m["how"]}' + (f' {m["score"]:.2f})' if m["how"] == "fuzzy" else ")")
+        lines.append(f"- `{m['col']}` == {m['value']!r}{note}")
+    return "\n".join(lines)
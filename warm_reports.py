@@ -0,0 +1,183 @@
+import os
+import json
+import time
+import pickle
+import hashlib
+import shutil
+import threading
+
+from engine import run_query
+from jobs import JobCancelled
+from scheduler import PRIORITY_PRECOMPUTE, priority_scope
+from snippet_library import _TRAILING_PUNCT, _normalize_text, is_followup
+
+# -----------------------------------------------------------------------------
+# 预计算报告: 数据集加载 / 刷新后在后台把建议问题和高频问题完整跑一遍，
+#   按数据集版本落盘完整的 report_block，点击建议卡片或再次提问时直接展示，不再等 20~40s
+#   刷新策略 (环境变量):
+#     WARM_REPORT_POLICY  on_load (默认，每个数据集版本预计算一次) | off
+#     WARM_REPORT_MAX_AGE_H  报告最长保留小时数，过期后下一轮重算；0 = 只随数据集版本失效
+#     WARM_REPORT_TOP_N  除建议问题外，额外预计算的高频问题个数
+# -----------------------------------------------------------------------------
+
+WARM_DIR = os.path.join(".cache", "warm_reports")
+WARM_POLICY = os.environ.get("WARM_REPORT_POLICY", "on_load").lower()
+WARM_MAX_AGE_H = float(os.environ.get("WARM_REPORT_MAX_AGE_H", 24))
+WARM_TOP_N = int(os.environ.get("WARM_REPORT_TOP_N", 5))
+WARM_MIN_COUNT = 3           # 至少被问过这么多次才算高频问题
+MAX_TRACKED_QUERIES = 200
+WARM_SESSION = "warmup"
+COUNTS_FILE = "query_counts.json"
+
+SUGGESTED_QUERIES = [
+    ("🗺️", "MARKET SHARE", "What is the market share by province?"),
+    ("📈", "GROWTH RATE", "Which products have high YoY growth?"),
+    ("📊", "REGIONAL TREND", "Analyze regional performance trends."),
+]
+
+
+def _normalize_query(query):
+    # 与片段库的指纹共用同一套归一化，只额外去掉句末标点
+    return _normalize_text(query).rstrip(_TRAILING_PUNCT)
+
+
+def query_key(query):
+    return hashlib.sha1(_normalize_query(query).encode()).hexdigest()[:16]
+
+
+class WarmReportStore:
+    """{数据集版本: {问题: 完整 assistant 消息}}，内存 + 磁盘 (pickle) 两级；换版本时旧目录整体删除。"""
+
+    def __init__(self, root=WARM_DIR, max_age_h=WARM_MAX_AGE_H):
+        self.root = root
+        self.max_age_s = max_age_h * 3600
+        self._lock = threading.Lock()
+        self._mem = {}
+        self._counts = self._load_counts()
+
+    def _path(self, version, query):
+        return os.path.join(self.root, str(version), f"{query_key(query)}.pkl")
+
+    def _expired(self, entry):
+        return bool(self.max_age_s) and time.time() - entry["created"] > self.max_age_s
+
+    def get(self, version, query):
+        """返回 {query, message, created}；未命中或已过期返回 None。"""
+        path = self._path(version, query)
+        with self._lock:
+            entry = self._mem.get(path)
+        if entry is None and os.path.exists(path):
+            try:
+                with open(path, "rb") as f:
+                    entry = pickle.load(f)
+            except Exception:
+                entry = None
+            if entry is not None:
+                with self._lock:
+                    self._mem[path] = entry
+        if entry is None or self._expired(entry):
+            return None
+        return entry
+
+    def put(self, version, query, message):
+        entry = {"query": query, "message": message, "created": time.time()}
+        path = self._path(version, query)
+        with self._lock:
+            self._mem[path] = entry
+            # 只保留当前版本
+            self._mem = {p: e for p, e in self._mem.items() if os.path.dirname(p) == os.path.dirname(path)}
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            for old in os.listdir(self.root):
+                if old != str(version) and os.path.isdir(os.path.join(self.root, old)):
+                    shutil.rmtree(os.path.join(self.root, old), ignore_errors=True)
+            tmp = path + ".tmp"
+            with open(tmp, "wb") as f:
+                pickle.dump(entry, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp, path)
+        except OSError:
+            pass
+        return entry
+
+    def ready(self, version, queries):
+        return sum(self.get(version, q) is not None for q in queries)
+
+    # --- 高频问题统计 ---
+    def _load_counts(self):
+        try:
+            with open(os.path.join(self.root, COUNTS_FILE), "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def record(self, query):
+        if is_followup(query):
+            return
+        norm = _normalize_query(query)
+        with self._lock:
+            item = self._counts.setdefault(norm, {"query": query, "count": 0})
+            item["count"] += 1
+            if len(self._counts) > MAX_TRACKED_QUERIES:
+                keep = sorted(self._counts.items(), key=lambda kv: kv[1]["count"], reverse=True)[:MAX_TRACKED_QUERIES]
+                self._counts = dict(keep)
+            snapshot = dict(self._counts)
+        try:
+            os.makedirs(self.root, exist_ok=True)
+            tmp = os.path.join(self.root, COUNTS_FILE + ".tmp")
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(snapshot, f, ensure_ascii=False)
+            os.replace(tmp, os.path.join(self.root, COUNTS_FILE))
+        except OSError:
+            pass
+
+    def top_queries(self, n=WARM_TOP_N, min_count=WARM_MIN_COUNT):
+        with self._lock:
+            items = sorted(self._counts.values(), key=lambda v: v["count"], reverse=True)
+        return [v["query"] for v in items if v["count"] >= min_count][:n]
+
+
+def warm_queries(store):
+    """建议问题 + 高频问题 (去重，保持顺序)。"""
+    queries, seen = [], set()
+    for q in [q for _, _, q in SUGGESTED_QUERIES] + store.top_queries():
+        key = query_key(q)
+        if key not in seen:
+            seen.add(key)
+            queries.append(q)
+    return queries
+
+
+def serve(entry):
+    """取出一份可直接追加到会话的消息 (浅拷贝，标注预计算时间)。"""
+    message = entry["message"]
+    return {**message, "content": {**message["content"], "warm_at": entry["created"]}}
+
+
+def precompute_reports(client, workspace, store, queries=None, force=False, token=None, progress=None):
+    """逐个问题跑完整管线并落盘，已有且未过期的跳过；返回 {computed, skipped, failed}。"""
+    queries = warm_queries(store) if queries is None else queries
+    version = workspace['version']
+    stats = {"computed": 0, "skipped": 0, "failed": 0, "total": len(queries)}
+    # 整个预计算压到最低一档，用户报告的路由 / 生成 / 解读 / 汇总请求始终先走
+    with priority_scope(PRIORITY_PRECOMPUTE):
+        for i, query in enumerate(queries):
+            if token is not None: token.check()
+            if not force and store.get(version, query) is not None:
+                stats["skipped"] += 1
+                continue
+            if progress is not None: progress(f"WARMING {i + 1}/{len(queries)}: {query}", stats)
+            try:
+                message = run_query(client, query, workspace, token=token, session_id=WARM_SESSION)
+            except JobCancelled:
+                raise
+            except Exception:
+                stats["failed"] += 1
+                continue
+            # 只缓存有结果的报告，纯文本回复 / 全部角度失败的问题留给用户实时提问时再跑
+            content = message["content"] if message["type"] == "report_block" else {}
+            if content.get("data") or content.get("angles_data"):
+                store.put(version, query, message)
+                stats["computed"] += 1
+            else:
+                stats["failed"] += 1
+    return stats